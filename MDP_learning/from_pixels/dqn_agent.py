@@ -3,9 +3,10 @@ from keras.layers import Permute, Conv2D, Flatten, Dense
 from keras.optimizers import Adam
 from rl.agents import DQNAgent
 from rl.callbacks import ModelIntervalCheckpoint, FileLogger
-from rl.memory import SequentialMemory
 from rl.policy import LinearAnnealedPolicy, EpsGreedyQPolicy
 
+from MDP_learning.from_pixels.pixel_memory import PixelMemory
+
 
 def setupDQN(cfg, nb_actions, processor):
     image_in = Input(shape=cfg.input_shape, name='main_input')
@@ -22,7 +23,8 @@ def setupDQN(cfg, nb_actions, processor):
 
     # Finally, we configure and compile our agent. You can use every built-in Keras optimizer and
     # even the metrics!
-    memory = SequentialMemory(limit=cfg.memory_limit, window_length=cfg.WINDOW_LENGTH)
+    # the replay memory keeps each processed frame once, trainML and train_icm sample their data from it
+    memory = PixelMemory(cfg.memory_limit, cfg.INPUT_SHAPE, cfg.WINDOW_LENGTH)
 
     # Select a policy. We use eps-greedy action selection, which means that a random action is selected
     # with probability eps. We anneal eps from 1.0 to 0.1 over the course of 1M steps. This is done so that
@@ -1,6 +1,5 @@
 from __future__ import division
 import argparse
-import random
 import time
 import os
 import numpy as np
@@ -66,13 +65,20 @@ def trainML(cfg, dqn, sequence_length, layer_width_multi=1, do_diff=False):
     model_truncated = Model(inputs=dqn.model.input, outputs=conv_features.output)
     print(model_truncated.summary())
 
-    data_size = dqn.memory.observations.length
+    # hidden states of [n_seq, sample_length, window, h, w] frame stacks
+    def encode(states):
+        batch = dqn.process_state_batch(states.reshape((-1,) + states.shape[2:]))
+        return np.reshape(model_truncated.predict_on_batch(batch), states.shape[:2] + (hstate_size,))
+
+    data_size = dqn.memory.nb_entries
     chunk_size = int(data_size / 100) + 1
     n_rounds = 2 * int(data_size / chunk_size) + 1  # go through data 2 times
+    n_seq = 64  # sequences gathered and encoded at a time
     if do_diff:
         sample_length = sequence_length + 1
     else:
         sample_length = sequence_length
+    valid_starts = dqn.memory.sequence_starts(sample_length)
     for ii in range(n_rounds):
         print("{} of {} n_rounds".format(ii, n_rounds))
         hstates = np.empty((chunk_size, sequence_length, hstate_size), dtype=np.float32)
@@ -81,62 +87,23 @@ def trainML(cfg, dqn, sequence_length, layer_width_multi=1, do_diff=False):
         rewards = np.empty((chunk_size, 1), dtype=np.float32)
         terminals = np.empty((chunk_size, 1), dtype=np.float32)
 
-        for jj in range(chunk_size):
-            print("{} of {} chunk_size".format(jj, chunk_size))
-            # check for terminals
-            start = random.randrange(dqn.memory.window_length + 1, data_size - sample_length)
-            batch_idxs = range(start, start + sample_length)
-            if np.min(batch_idxs) >= dqn.memory.window_length + 1:
-                experiences = dqn.memory.sample(sample_length, batch_idxs)
-            else:
-                assert False
-            while np.array([e.terminal1 for e in experiences]).any():
-                if start is 0:
-                    start = random.randrange(data_size - sample_length)
-                else:
-                    start -= 1  # get a bit more terminal
-                experiences = dqn.memory.sample(sample_length, range(start, start + sample_length))
-
-            # Start by extracting the necessary parameters (we use a vectorized implementation).
-            state0_seq = []
-            state1_seq = []
-            reward_seq = []
-            action_seq = []
-            terminal1_seq = []
-
-            for e in experiences:
-                state0_seq.append(e.state0)
-                state1_seq.append(e.state1)
-                reward_seq.append(e.reward)
-                action_seq.append(e.action)
-                terminal1_seq.append(e.terminal1)
-
-            # TODO consider differencing
-            state0_seq = dqn.process_state_batch(state0_seq)
-            state1_seq = dqn.process_state_batch(state1_seq)
-            reward_seq = np.array(reward_seq)
-            action_seq = np.array(action_seq, dtype=np.float32)
-            terminal1_seq = np.array(terminal1_seq)
-
-            hidden_state0_seq = model_truncated.predict_on_batch(state0_seq)
-            hidden_state1_seq = model_truncated.predict_on_batch(state1_seq)
-            if do_diff:
-                hidden_state0_seq = np.reshape(
-                    hidden_state0_seq[1:, ...] - hidden_state0_seq[:-1, ...], (sequence_length, hstate_size))
-                hidden_state1_seq = np.reshape(
-                    hidden_state1_seq[1:, ...] - hidden_state1_seq[:-1, ...], (sequence_length, hstate_size))
-            else:
-                hidden_state0_seq = np.reshape(hidden_state0_seq, (sequence_length, hstate_size))
-                hidden_state1_seq = np.reshape(hidden_state1_seq, (sequence_length, hstate_size))
-
-            hstates[jj, :, :] = hidden_state0_seq
+        # frames are gathered one block of n_seq sequences at a time, only their hidden states are kept
+        starts = np.random.choice(valid_starts, size=chunk_size)
+        for kk in range(0, chunk_size, n_seq):
+            seqs = dqn.memory.gather_sequences(starts[kk:kk + n_seq], sample_length)
+            hidden_state0_seq = encode(seqs['state0'])
+            hidden_state1_seq = encode(seqs['state1'])
+            action_seq = seqs['action'].astype(np.float32)
             if do_diff:
-                actions[jj, :, :] = action_seq[1:, np.newaxis]
-            else:
-                actions[jj, :, :] = action_seq[:, np.newaxis]
-            next_hstate[jj, :] = hidden_state1_seq[-1, :]
-            rewards[jj, :] = reward_seq[-1]
-            terminals[jj, :] = terminal1_seq[-1]
+                hidden_state0_seq = hidden_state0_seq[:, 1:, :] - hidden_state0_seq[:, :-1, :]
+                hidden_state1_seq = hidden_state1_seq[:, 1:, :] - hidden_state1_seq[:, :-1, :]
+                action_seq = action_seq[:, 1:]
+
+            hstates[kk:kk + n_seq] = hidden_state0_seq
+            actions[kk:kk + n_seq] = action_seq[:, :, np.newaxis]
+            next_hstate[kk:kk + n_seq] = hidden_state1_seq[:, -1, :]
+            rewards[kk:kk + n_seq] = seqs['reward'][:, -1:]
+            terminals[kk:kk + n_seq] = seqs['terminal1'][:, -1:]
 
         if False:  # Debug
             with open("{}DataStats.txt".format(cfg.env_name), "w") as text_file:
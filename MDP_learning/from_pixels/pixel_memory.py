@@ -0,0 +1,114 @@
+import numpy as np
+from rl.memory import Memory, Experience, sample_batch_indexes
+
+
+# keras-rl agent memory storing every (processed, uint8) frame exactly once, in a ring of `limit` entries.
+# Frame stacks, sequences of stacks and (state0, state1) pairs are built as index
+# arrays into `frames` and gathered with a single take, instead of keras-rl's
+# SequentialMemory.sample which copies window_length frames per experience.
+# Indexing follows SequentialMemory: entry 0 is the oldest, experience idx has state0 ending at
+# entry idx - 1, action/reward/terminal1 at idx - 1 and state1 ending at entry idx.
+class PixelMemory(Memory):
+    def __init__(self, limit, frame_shape, window_length, ignore_episode_boundaries=False):
+        super(PixelMemory, self).__init__(window_length=window_length,
+                                          ignore_episode_boundaries=ignore_episode_boundaries)
+        self.limit = limit
+        # one extra all-zero frame, used to pad stacks at episode starts
+        self.frames = np.zeros((limit + 1,) + tuple(frame_shape), dtype=np.uint8)
+        self.zero_frame = limit
+        self.actions = np.zeros(limit, dtype=np.int32)
+        self.rewards = np.zeros(limit, dtype=np.float32)
+        self.terminals = np.zeros(limit, dtype=np.bool_)
+        self.top = 0
+        self.size = 0
+
+    @property
+    def nb_entries(self):
+        return self.size
+
+    def append(self, observation, action, reward, terminal, training=True):
+        super(PixelMemory, self).append(observation, action, reward, terminal, training=training)
+        if training:
+            ii = self.top
+            self.frames[ii] = observation
+            self.actions[ii] = action
+            self.rewards[ii] = reward
+            self.terminals[ii] = terminal
+            self.top = (ii + 1) % self.limit
+            self.size = min(self.size + 1, self.limit)
+
+    def get_config(self):
+        config = super(PixelMemory, self).get_config()
+        config['limit'] = self.limit
+        return config
+
+    # ring rows of entries idx (0 the oldest)
+    def physical(self, idx):
+        return (np.asarray(idx) + self.top - self.size) % self.limit
+
+    # frame rows (..., window_length), oldest first, of the stack ending at entry `last`;
+    # entries that lie before the start of the episode point to the zero frame
+    def stack_index(self, last):
+        last = np.asarray(last)
+        back = np.arange(self.window_length)[::-1]  # offset of each stack slot from `last`
+        index = last[..., np.newaxis] - back
+        cut = index < 0
+        if not self.ignore_episode_boundaries:
+            # an older frame is dropped if the step before it was terminal, and so is every frame before it
+            prev = index - 1
+            cut |= (prev >= 0) & self.terminals[self.physical(np.maximum(prev, 0))]
+        cut[..., -1] = False
+        cut = np.flip(np.logical_or.accumulate(np.flip(cut, -1), axis=-1), -1)
+        return np.where(cut, self.zero_frame, self.physical(index))
+
+    # experiences idx (any shape) as one dict of arrays
+    def gather(self, idx):
+        idx = np.asarray(idx)
+        index0 = self.stack_index(idx - 1)
+        index1 = np.concatenate((index0[..., 1:], self.physical(idx)[..., np.newaxis]), axis=-1)
+        rows = self.physical(idx - 1)
+        return {'state0': self.frames.take(index0, axis=0),
+                'state1': self.frames.take(index1, axis=0),
+                'action': self.actions[rows],
+                'reward': self.rewards[rows],
+                'terminal1': self.terminals[rows]}
+
+    # keras-rl's Memory.sample: batch_size Experiences, one gather for the whole batch
+    def sample(self, batch_size, batch_idxs=None):
+        assert self.nb_entries >= self.window_length + 2, 'not enough entries in the memory'
+        if batch_idxs is None:
+            batch_idxs = sample_batch_indexes(self.window_length, self.nb_entries - 1, size=batch_size)
+        idx = np.array(batch_idxs) + 1
+        # experiences right after a terminal are redrawn, as in SequentialMemory.sample
+        redraw = self.terminals[self.physical(idx - 2)]
+        while redraw.any():
+            idx[redraw] = np.random.randint(self.window_length + 1, self.nb_entries, size=redraw.sum())
+            redraw = self.terminals[self.physical(idx - 2)]
+        batch = self.gather(idx)
+        return [Experience(state0=state0, action=action, reward=reward, state1=state1, terminal1=terminal1)
+                for state0, action, reward, state1, terminal1 in zip(batch['state0'], batch['action'],
+                                                                      batch['reward'], batch['state1'],
+                                                                      batch['terminal1'])]
+
+    # batch_size random experiences as one dict, never starting right after a terminal (as SequentialMemory.sample)
+    def sample_batch(self, batch_size):
+        candidates = np.arange(self.window_length + 1, self.nb_entries)
+        candidates = candidates[~self.terminals[self.physical(candidates - 2)]]
+        return self.gather(np.random.choice(candidates, size=batch_size))
+
+    # starts of the runs of sequence_length consecutive experiences without a terminal1 inside
+    def sequence_starts(self, sequence_length):
+        terminal_count = np.concatenate(([0], np.cumsum(self.terminals[self.physical(np.arange(self.size))])))
+        starts = np.arange(self.window_length + 1, self.nb_entries - sequence_length)
+        # terminal1 of experiences start .. start + sequence_length - 1 are entries start - 1 ...
+        clean = terminal_count[starts + sequence_length - 1] - terminal_count[starts - 1] == 0
+        return starts[clean]
+
+    # the sequences starting at `starts`, every entry of the result has shape (len(starts), sequence_length, ...)
+    def gather_sequences(self, starts, sequence_length):
+        return self.gather(np.asarray(starts)[:, np.newaxis] + np.arange(sequence_length))
+
+    # n_seq random sequences of sequence_length experiences without a terminal1 inside
+    def sample_sequences(self, n_seq, sequence_length):
+        return self.gather_sequences(np.random.choice(self.sequence_starts(sequence_length), size=n_seq),
+                                     sequence_length)
@@ -143,32 +143,18 @@ def train_icm(cfg, dqn, nb_actions, do_load_dqn_weights=True):
     print('logging to {}'.format(log_string))
     ####################################################################################################################
 
-    data_size = dqn.memory.observations.length
+    data_size = dqn.memory.nb_entries
     chunk_size = int(max(min(data_size / 2, 10000), data_size / 100))
     n_rounds = 2 * int(data_size / chunk_size) + 1  # go through data 3 times
     for ii in range(n_rounds):
         print("{} of {} n_rounds".format(ii, n_rounds))
-        experiences = dqn.memory.sample(chunk_size)
-        # Start by extracting the necessary parameters
-        state0_seq = []
-        state1_seq = []
-        reward_seq = []
-        action_seq = []
-        terminal1_seq = []
-
-        for e in experiences:
-            state0_seq.append(e.state0)
-            state1_seq.append(e.state1)
-            reward_seq.append(e.reward)
-            action_seq.append(e.action)
-            terminal1_seq.append(e.terminal1)
-
-        state0_seq = dqn.process_state_batch(state0_seq)
-        state1_seq = dqn.process_state_batch(state1_seq)
+        batch = dqn.memory.sample_batch(chunk_size)
+        state0_seq = dqn.process_state_batch(batch['state0'])
+        state1_seq = dqn.process_state_batch(batch['state1'])
         hstate1_seq = shared_conv_model.predict_on_batch(state1_seq)
-        reward_seq = np.array(reward_seq)
-        action_seq = np.array(action_seq)
-        terminal1_seq = np.array(terminal1_seq)
+        reward_seq = batch['reward']
+        action_seq = batch['action']
+        terminal1_seq = batch['terminal1']
 
         # one hot encode
         actions_encoded = to_categorical(action_seq, num_classes=nb_actions)
@@ -20,7 +20,7 @@ class AtariProcessor(Processor):
     def process_observation(self, observation):
         assert observation.ndim == 3  # (height, width, channel)
         img = Image.fromarray(observation)
-        img = img.resize(INPUT_SHAPE).convert('L')  # resize and convert to grayscale
+        img = img.resize(INPUT_SHAPE[::-1]).convert('L')  # resize (PIL takes width, height) and convert to grayscale
         processed_observation = np.array(img)
         assert processed_observation.shape == INPUT_SHAPE
         return processed_observation.astype('uint8')  # saves storage in experience memory
@@ -128,32 +128,43 @@ class ModelLearner():
         return model
 
 
-def get_rollouts(env, batch_size, seed=None):
-    rollout_limit = env.spec.timestep_limit
-    states, actions, rewards = [], [], []
-    for j in range(batch_size):
-        env.seed(seed)
-        s = env.reset()
-        rollout_s, rollout_a, rollout_r = [], [], []
+# Random-policy transitions of n_rollouts rollouts of at most rollout_limit steps, yielded as training
+# minibatches of minibatch_size (states, actions, rewards), the last one of the rollouts
+# shorter. Frames are preprocessed to uint8 INPUT_SHAPE as they arrive and go straight into preallocated
+# buffers, so memory is bounded by the minibatch size instead of whole rollouts of raw frames;
+# the yielded arrays are reused for the next minibatch. With a seed, rollout j starts from env.seed(seed + j).
+def rollout_batches(env, processor, n_rollouts, minibatch_size, rollout_limit=None, seed=None):
+    rollout_limit = rollout_limit or env.spec.timestep_limit
+    states = np.empty((minibatch_size,) + INPUT_SHAPE, dtype=np.uint8)
+    actions = np.empty((minibatch_size, 1), dtype=np.float32)
+    rewards = np.empty(minibatch_size, dtype=np.float32)
+    n = 0
+    for j in range(n_rollouts):
+        env.seed(None if seed is None else seed + j)
+        frame = processor.process_observation(env.reset())
         for i in range(rollout_limit):
             a = env.action_space.sample()
             s1, r, done, _ = env.step(a)
-            rollout_s.append(s)
-            rollout_a.append(a)
-            rollout_r.append(r)
-            s = s1
+            next_frame = processor.process_observation(s1)
+            states[n] = frame
+            actions[n] = a
+            rewards[n] = r
+            n += 1
+            if n == minibatch_size:
+                yield states, actions, rewards
+                n = 0
+            frame = next_frame
             if done: break
-        env.seed(None)
-        states.append(np.array(rollout_s))
-        actions.append(np.array(rollout_a))
-        rewards.append(np.array(rollout_r))
-    return np.array(states), np.array(actions), np.array(rewards)
+    env.seed(None)
+    if n:
+        yield states[:n], actions[:n], rewards[:n]
 
 
 # training settings
 
 epochs = 1000  # number of training batches
 batch_size = 10  # number of rollouts per training batch
+minibatch_size = 32  # transitions per model update
 rollout_limit = env.spec.timestep_limit  # max rollout length
 discount_factor = 1.00  # reward discount factor (gamma), 1.0 = no discount
 learning_rate = 0.001  # you know this by now
@@ -164,30 +175,20 @@ early_stop_loss = 0  # stop training if loss < early_stop_loss, 0 or False to di
 if __name__ == "__main__":
     for env_name in ['Breakout-v0']:
         env = gym.make(env_name)
-        # get size of state and action from environment
-        state_shape = env.observation_space.shape
+        # preprocessed frames with one channel
+        state_shape = INPUT_SHAPE + (WINDOW_LENGTH,)
         action_shape = (1,)  # TODO: get shape from environment. something like env.action.space.shape?
         num_discrete_actions = env.action_space.n
-        agent = ModelLearner(state_shape, action_shape, num_discrete_actions)  # TODO: prepro of frames
-        states, actions, rewards = [], [], []  # lists of rollouts
+        agent = ModelLearner(state_shape, action_shape, num_discrete_actions)
+        processor = AtariProcessor()
         for epoch in range(epochs):
-            # fill batch with rollouts
-            states, actions, rewards = get_rollouts(env, batch_size, seed=epoch)
-            # iterate over rollouts
-            for rollout_num in range(batch_size):
-            # iterate over states in rollout
-                for i in range(len(states[rollout_num])-1):
-                    state1 = np.reshape(states[rollout_num][i], (1,) + states[rollout_num][i].shape)
-                    state2 = np.reshape(states[rollout_num][i+1], (1,) + states[rollout_num][i+1].shape)
-                    states_tr = np.concatenate((state1,state2),axis=0)
-                    action = np.reshape(actions[rollout_num][i], (1,) + actions[rollout_num][i].shape)
-                    # get label for state prediction
-                    target = agent.model.predict([state1, action], batch_size=1)
-                    agent.model.fit([states_tr,action],
-                              [target],
-                              batch_size=1,
-                              #validation_split=0.1,
-                              verbose=1)
+            # the transitions of batch_size rollouts, streamed in minibatches
+            for states, actions, rewards in rollout_batches(env, processor, batch_size, minibatch_size,
+                                                            rollout_limit, seed=epoch * batch_size):
+                states = processor.process_state_batch(states)[..., np.newaxis]
+                # get label for state prediction
+                target = agent.model.predict_on_batch([states, actions])
+                agent.model.train_on_batch([states, actions], target)
             '''
             get_layer_output = K.function([agent.model.layers[0].input, agent.model.layers[8].input],
                                           [agent.model.layers[11].output])
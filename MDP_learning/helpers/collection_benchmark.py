@@ -0,0 +1,208 @@
+import argparse
+import multiprocessing
+import resource
+import sys
+from collections import deque
+from time import time
+
+import numpy as np
+
+from MDP_learning.helpers.standin_envs import make_standin
+
+# Throughput of the collection paths (dynamics_learning.refill_mem, multi.fill_memory and the memory side
+# of keras-rl's fit loop) on the pure-NumPy stand-in environments, so collection speed can be compared
+# on any machine without MuJoCo, Atari or the particle envs. Every benchmark runs in a fresh process,
+# which makes its peak RSS its own. Run as
+#   python -m MDP_learning.helpers.collection_benchmark --steps 100000
+
+
+# the single-agent learner with only what refill_mem reads: no networks and no log directories
+def refill_learner(memory, data_size, n_envs=1):
+    from MDP_learning.single_agent.dynamics_learning import ModelLearner
+
+    class RefillOnly(ModelLearner):
+        def __init__(self):
+            self.memory = memory
+            self.data_size = data_size
+            self.round_size = data_size
+            self.n_envs = n_envs
+            self.n_workers = 1
+            self.collect_seed = None
+            self.continual = None
+            self.scaling_warmup = 0
+
+    return RefillOnly()
+
+
+def bench_refill_mem(env_name, n_steps):
+    from MDP_learning.single_agent.memory import TransitionMemory
+    env = make_standin(env_name)
+    action_size = sum(env.action_space.shape) if env.action_space.shape else 1
+    learner = refill_learner(TransitionMemory(n_steps, env.observation_space.shape[0], action_size), n_steps)
+    learner.refill_mem(env)
+    return learner.memory
+
+
+def bench_refill_mem_compact(env_name, n_steps):
+    from MDP_learning.single_agent.memory import CompactTransitionMemory
+    env = make_standin(env_name)
+    memory = CompactTransitionMemory(n_steps, env.observation_space.shape[0], env.action_space.shape[0],
+                                     state_dtype=np.float16,
+                                     state_offset=env.observation_space.low,
+                                     state_scale=env.observation_space.high - env.observation_space.low)
+    learner = refill_learner(memory, n_steps)
+    learner.refill_mem(env)
+    return learner.memory
+
+
+def bench_refill_mem_vectorized(env_name, n_steps, n_envs=8):
+    from MDP_learning.helpers.vec_env import VecEnv
+    from MDP_learning.single_agent.memory import TransitionMemory
+    envs = VecEnv([make_standin(env_name) for _ in range(n_envs)])
+    learner = refill_learner(TransitionMemory(n_steps, envs.observation_space.shape[0],
+                                              envs.action_space.shape[0]), n_steps, n_envs=n_envs)
+    learner.refill_mem(envs)
+    return learner.memory
+
+
+def bench_fill_memory(env_name, n_steps, sequence_length=0):
+    from MDP_learning.multi_agent.multi import MultiAgentModelLearner
+    from MDP_learning.multi_agent.memory import MultiAgentMemory
+    import MDP_learning.multi_agent.policies as MAPolicies
+    env = make_standin(env_name)
+
+    # the multi-agent learner with only what fill_memory reads
+    class FillOnly(MultiAgentModelLearner):
+        def __init__(self):
+            self.env = env
+            self.render = False
+            self.random_resets = True
+            self.reset_randomrange = 3 if sequence_length > 0 else int(n_steps / 100) + 2
+            self.mem_size = n_steps
+            self.sequence_length = sequence_length
+            self.n_workers = 1
+            self.collect_seed = None
+            self.memory = MultiAgentMemory(n_steps,
+                                           [env.observation_space[ii].shape[0] for ii in range(env.n)],
+                                           [MAPolicies.get_action_and_comm_actual_size(env, ii)[0]
+                                            for ii in range(env.n)])
+            self.policy = MAPolicies.BatchRandomPolicy(env)
+
+    learner = FillOnly()
+    learner.fill_memory()
+    return learner.memory
+
+
+# the steps of keras-rl's Agent.fit that touch the memory: process the frame, append, reset on done
+def fill_pixel_memory(env, memory, processor, n_steps):
+    observation = processor.process_observation(env.reset())
+    for i in range(n_steps):
+        action = env.action_space.sample()
+        next_observation, reward, done, info = env.step(action)
+        memory.append(observation, action, processor.process_reward(reward), done)
+        if done:
+            next_observation = env.reset()
+        observation = processor.process_observation(next_observation)
+    return memory
+
+
+def bench_sequential_memory(env_name, n_steps):
+    from rl.memory import SequentialMemory
+    from MDP_learning.from_pixels.atari_preprocessor import AtariProcessor
+    return fill_pixel_memory(make_standin(env_name), SequentialMemory(limit=n_steps, window_length=4),
+                             AtariProcessor((84, 84)), n_steps)
+
+
+def bench_pixel_memory(env_name, n_steps):
+    from MDP_learning.from_pixels.pixel_memory import PixelMemory
+    from MDP_learning.from_pixels.atari_preprocessor import AtariProcessor
+    return fill_pixel_memory(make_standin(env_name), PixelMemory(n_steps, (84, 84), 4),
+                             AtariProcessor((84, 84)), n_steps)
+
+
+# name: (collection function, stand-in environment)
+BENCHMARKS = {
+    'refill_mem/Swimmer': (bench_refill_mem, 'Swimmer'),
+    'refill_mem/Hopper': (bench_refill_mem, 'Hopper'),
+    'refill_mem/CartPole': (bench_refill_mem, 'CartPole'),
+    'refill_mem_compact/Hopper': (bench_refill_mem_compact, 'Hopper'),
+    'refill_mem_vectorized/Hopper': (bench_refill_mem_vectorized, 'Hopper'),
+    'fill_memory/simple': (bench_fill_memory, 'simple'),
+    'fill_memory/simple_spread': (bench_fill_memory, 'simple_spread'),
+    'keras-rl_SequentialMemory/Breakout': (bench_sequential_memory, 'Breakout'),
+    'PixelMemory/Breakout': (bench_pixel_memory, 'Breakout'),
+}
+
+
+# bytes held by an object and everything it references, arrays counted once by their owning buffer
+def deep_nbytes(obj, seen=None):
+    seen = set() if seen is None else seen
+    while isinstance(obj, np.ndarray) and isinstance(obj.base, np.ndarray):
+        obj = obj.base
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return size + sum(deep_nbytes(k, seen) + deep_nbytes(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return size + sum(deep_nbytes(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        return size + deep_nbytes(vars(obj), seen)
+    return size
+
+
+# peak resident set size of this process in MB (ru_maxrss is in KB on Linux)
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run_benchmark(name, n_steps):
+    fill, env_name = BENCHMARKS[name]
+    try:
+        fill(env_name, 100)  # imports and first-call overheads
+        rss_before = peak_rss_mb()
+        start = time()
+        memory = fill(env_name, n_steps)
+        seconds = time() - start
+    except ImportError as e:
+        return {'name': name, 'skipped': str(e)}
+    return {'name': name,
+            'steps/s': n_steps / seconds,
+            'bytes/transition': deep_nbytes(memory) / float(n_steps),
+            'peak RSS MB': peak_rss_mb(),
+            'RSS growth MB': peak_rss_mb() - rss_before}
+
+
+def run_benchmarks(names, n_steps):
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for name in names:
+        pool = ctx.Pool(1)
+        try:
+            results.append(pool.apply(run_benchmark, (name, n_steps)))
+        finally:
+            pool.terminate()
+    return results
+
+
+def print_results(results, n_steps):
+    print('{} steps per benchmark'.format(n_steps))
+    print('{:<36} {:>12} {:>18} {:>14} {:>14}'.format('benchmark', 'steps/s', 'bytes/transition',
+                                                    'peak RSS MB', 'RSS growth MB'))
+    for r in results:
+        if 'skipped' in r:
+            print('{:<36} skipped: {}'.format(r['name'], r['skipped']))
+        else:
+            print('{:<36} {:>12.0f} {:>18.1f} {:>14.1f} {:>14.1f}'.format(
+                r['name'], r['steps/s'], r['bytes/transition'], r['peak RSS MB'], r['RSS growth MB']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Collection throughput on stand-in environments.')
+    parser.add_argument('--steps', type=int, default=100000)
+    parser.add_argument('--benchmarks', nargs='*', default=sorted(BENCHMARKS), choices=sorted(BENCHMARKS))
+    args = parser.parse_args()
+    print_results(run_benchmarks(args.benchmarks, args.steps), args.steps)
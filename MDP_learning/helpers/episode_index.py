@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# Episode boundaries recorded while a memory is being filled.
+# Steps are counted absolutely, so a bounded memory that only keeps the last
+# `size` steps asks for its episodes from `first = total - size` onwards.
+class EpisodeIndex(object):
+    def __init__(self):
+        self.starts = [0]
+        self.total = 0
+        self._cache = {}
+
+    def clear(self):
+        self.starts = [0]
+        self.total = 0
+        self._cache = {}
+
+    def step(self, done):
+        self.total += 1
+        if done:
+            self.starts.append(self.total)
+
+    # record a whole slab of steps at once
+    def extend(self, dones):
+        ends = np.flatnonzero(dones) + self.total + 1
+        self.starts.extend(ends.tolist())
+        self.total += len(dones)
+
+    # end the current episode without a terminal, e.g. where two collection streams meet
+    def split(self):
+        if self.starts[-1] != self.total:
+            self.starts.append(self.total)
+
+    # (starts, lengths) of the episodes in steps [first, total), relative to first
+    def episodes(self, first=0):
+        starts = np.asarray(self.starts, dtype=np.int64)
+        bounds = np.append(starts, self.total)
+        keep = bounds[1:] > first
+        starts = np.maximum(starts[keep], first)
+        lengths = bounds[1:][keep] - starts
+        nonempty = lengths > 0
+        return starts[nonempty] - first, lengths[nonempty]
+
+    # first rows of all windows of sequence_length steps that stay inside one episode,
+    # i.e. no terminal among the first sequence_length - 1 rows of the window
+    def valid_starts(self, sequence_length, first=0):
+        state = (first, self.total, len(self.starts))
+        if self._cache.get('state') != state:
+            self._cache = {'state': state}
+        if sequence_length not in self._cache:
+            starts, lengths = self.episodes(first)
+            counts = np.maximum(lengths - sequence_length + 1, 0)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            self._cache[sequence_length] = np.repeat(starts, counts) + offsets
+        return self._cache[sequence_length]
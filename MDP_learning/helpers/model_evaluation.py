@@ -1,10 +1,15 @@
 def sk_eval(model, input_data, train_signal, outfile_name=None):
     from sklearn.metrics import r2_score
+    from keras.utils import Sequence
     text_file = open(outfile_name, "w") if outfile_name is not None else None
 
     print(model.summary(), file=text_file)
 
-    y_pred = model.predict(input_data)
+    # input_data can also be a keras Sequence of (x, y) minibatches, e.g. a WindowSequence
+    if isinstance(input_data, Sequence):
+        y_pred = model.predict_generator(input_data, steps=len(input_data))
+    else:
+        y_pred = model.predict(input_data)
     print('r2_score(uniform_average): '
           '{}'.format(r2_score(train_signal, y_pred, multioutput='uniform_average')),
           file=text_file)
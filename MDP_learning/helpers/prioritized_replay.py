@@ -0,0 +1,105 @@
+import numpy as np
+from keras.callbacks import Callback
+
+
+# Array-backed sum tree over `capacity` priorities. Leaves live at [size, size + capacity)
+# of `tree`, every inner node holds the sum of its two children, the root is tree[1].
+# Updates and sampling work on whole index/value arrays, one pass per tree level.
+class SumTree(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.tree = np.zeros(2 * self.size, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def priorities(self, idx=None):
+        leaves = self.tree[self.size:self.size + self.capacity]
+        return leaves if idx is None else leaves[idx]
+
+    def update(self, idx, priorities):
+        nodes = np.asarray(idx) + self.size
+        self.tree[nodes] = priorities
+        # all leaves are on the same level, so the touched parents are too
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    # set all priorities at once and rebuild the inner nodes level by level
+    def set_all(self, priorities):
+        self.tree[:] = 0.
+        self.tree[self.size:self.size + self.capacity] = priorities
+        level = self.size
+        while level > 1:
+            level //= 2
+            self.tree[level:2 * level] = self.tree[2 * level:4 * level:2] + self.tree[2 * level + 1:4 * level:2]
+
+    # n leaf indices drawn with probability proportional to their priority
+    def sample(self, n):
+        mass = np.random.uniform(0., self.total, n)
+        nodes = np.ones(n, dtype=np.int64)
+        while nodes[0] < self.size:
+            left = 2 * nodes
+            go_right = mass >= self.tree[left]
+            mass = np.where(go_right, mass - self.tree[left], mass)
+            nodes = left + go_right
+        # guards against float round-off walking into an empty leaf
+        return np.minimum(nodes - self.size, self.capacity - 1)
+
+
+# Keras minibatches (x, y, importance weights) sampled in proportion to per-row model error.
+# The priorities are (mse + eps) ** alpha, recomputed for all rows with one batched predict
+# pass every `refresh_every` epochs; beta is the importance-sampling correction exponent.
+class PrioritizedSampler(Callback):
+    def __init__(self, x, y, alpha=0.6, beta=0.4, eps=1e-6, refresh_every=1, refresh_batch_size=4096):
+        super().__init__()
+        self.x = x
+        self.y = y
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.refresh_every = refresh_every
+        self.refresh_batch_size = refresh_batch_size
+        self.tree = SumTree(len(y))
+        self.tree.set_all(np.ones(len(y)))
+
+    def errors(self, model):
+        pred = model.predict(self.x, batch_size=self.refresh_batch_size)
+        return np.mean(np.reshape((pred - self.y) ** 2, (len(self.y), -1)), axis=1)
+
+    def refresh(self, model):
+        self.tree.set_all((self.errors(model) + self.eps) ** self.alpha)
+
+    def on_train_begin(self, logs=None):
+        self.refresh(self.model)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.refresh_every == 0:
+            self.refresh(self.model)
+
+    def batch(self, minibatch_size):
+        idx = self.tree.sample(minibatch_size)
+        prob = self.tree.priorities(idx) / self.tree.total
+        weights = (len(self.y) * prob) ** -self.beta
+        return self.x[idx], self.y[idx], (weights / weights.max()).astype(np.float32)
+
+    def generator(self, minibatch_size):
+        while True:
+            yield self.batch(minibatch_size)
+
+
+# fit on prioritized minibatches, keeping the last validation_split of the rows for validation
+def fit_prioritized(model, x, y, minibatch_size=32, epochs=1, steps_per_epoch=None, validation_split=0.1,
+                    callbacks=(), verbose=1, **sampler_args):
+    split = int(len(y) * (1. - validation_split))
+    sampler = PrioritizedSampler(x[:split], y[:split], **sampler_args)
+    return model.fit_generator(sampler.generator(minibatch_size),
+                               steps_per_epoch=steps_per_epoch or -(-split // minibatch_size),
+                               epochs=epochs,
+                               validation_data=(x[split:], y[split:]),
+                               callbacks=[sampler] + list(callbacks),
+                               verbose=verbose)
@@ -0,0 +1,177 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from MDP_learning.helpers.episode_index import EpisodeIndex
+
+COLUMNS = ('states', 'actions', 'rewards', 'next_states', 'dones')
+
+
+# Layout of a shared transition buffer. It is small and picklable, so it is what gets
+# handed to collector processes, which then attach to the shared block by name.
+class SharedBufferSpec(object):
+    def __init__(self, name, n_writers, capacity, state_size, action_size):
+        self.name = name
+        self.n_writers = n_writers
+        self.capacity = capacity  # rows per writer segment
+        self.state_size = state_size
+        self.action_size = action_size
+
+    def shapes(self):
+        n, c = self.n_writers, self.capacity
+        return [('counts', np.int64, (n,)),
+                ('states', np.float32, (n, c, self.state_size)),
+                ('actions', np.float32, (n, c, self.action_size)),
+                ('rewards', np.float32, (n, c)),
+                ('next_states', np.float32, (n, c, self.state_size)),
+                ('dones', np.bool_, (n, c))]
+
+    def nbytes(self):
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, dtype, shape in self.shapes())
+
+
+# numpy views of every column laid out back to back in one shared memory block
+def _column_views(spec, buf):
+    views, offset = {}, 0
+    for name, dtype, shape in spec.shapes():
+        views[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += views[name].nbytes
+    return views
+
+
+# Replay buffer living in multiprocessing.shared_memory, split into one segment per writer.
+# Each collector process owns one segment and is its only writer, so writes need no lock:
+# a row is written first and the segment's count is bumped afterwards, and readers only
+# look at rows below the count. The learner reads the segments in place, nothing is pickled.
+class SharedTransitionBuffer(object):
+    def __init__(self, n_writers, capacity, state_size, action_size):
+        self.spec = SharedBufferSpec(None, n_writers, capacity, state_size, action_size)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.spec.nbytes())
+        self.spec.name = self.shm.name
+        self.views = _column_views(self.spec, self.shm.buf)
+        self.views['counts'][:] = 0
+
+    def __len__(self):
+        return int(np.minimum(self.views['counts'], self.spec.capacity).sum())
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.as_array()
+        return arr if dtype is None else arr.astype(dtype)
+
+    def writer(self, writer_id):
+        return SharedTransitionWriter(self.spec, writer_id, shm=self.shm)
+
+    def reset(self):
+        self.views['counts'][:] = 0
+
+    # per-writer row counts, read once per call so that all columns it reads cover the same rows
+    def counts(self):
+        return self.views['counts'].copy()
+
+    # rows of one writer's segment, oldest first; views unless the segment has wrapped
+    def segment(self, writer_id, name, counts=None):
+        count = int((self.views['counts'] if counts is None else counts)[writer_id])
+        col = self.views[name][writer_id]
+        if count <= self.spec.capacity:
+            return col[:count]
+        top = count % self.spec.capacity
+        return np.concatenate((col[top:], col[:top]))
+
+    # one column over all segments. This is a view of the shared block when the rows already lie
+    # in order and back to back: no segment is mid-lap and every segment but the last is full.
+    # While collectors are running, views (and copies of wrapped segments) are not snapshots: rows
+    # below a segment's count stay as they are only until its writer laps them, and a wrapped
+    # segment's oldest rows can be overwritten, or caught half-written, while they are copied.
+    # Stop or pause the writers first where that matters.
+    def column(self, name, counts=None):
+        counts = self.counts() if counts is None else counts
+        capacity = self.spec.capacity
+        in_order = (counts <= capacity) | (counts % capacity == 0)
+        if in_order.all() and (counts[:-1] >= capacity).all():
+            col = self.views[name]
+            return col.reshape((-1,) + col.shape[2:])[:int(np.minimum(counts, capacity).sum())]
+        return np.concatenate([self.segment(ii, name, counts) for ii in range(self.spec.n_writers)])
+
+    def columns(self, counts=None):
+        counts = self.counts() if counts is None else counts
+        return dict((name, self.column(name, counts)) for name in COLUMNS)
+
+    def transition_batch(self, counts=None):
+        counts = self.counts() if counts is None else counts
+        states = self.column('states', counts)
+        return np.hstack((states, self.column('actions', counts))), self.column('next_states', counts) - states
+
+    # window starts per segment, shifted into the concatenated numbering of column()
+    def valid_starts(self, sequence_length, counts=None):
+        counts = self.counts() if counts is None else counts
+        starts, offset = [], 0
+        for ii in range(self.spec.n_writers):
+            dones = self.segment(ii, 'dones', counts)
+            index = EpisodeIndex()
+            index.extend(dones)
+            starts.append(index.valid_starts(sequence_length) + offset)
+            offset += len(dones)
+        return np.concatenate(starts)
+
+    def sequence_batch(self, sequence_length):
+        counts = self.counts()
+        starts = self.valid_starts(sequence_length, counts)
+        x, _ = self.transition_batch(counts)
+        windows = starts[:, np.newaxis] + np.arange(sequence_length)
+        return x[windows], self.column('next_states', counts)[starts + sequence_length - 1]
+
+    def as_array(self):
+        cols = self.columns()
+        return np.hstack((cols['states'], cols['actions'], cols['rewards'][:, np.newaxis],
+                          cols['next_states'], cols['dones'][:, np.newaxis]))
+
+    def close(self):
+        self.views = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+# Write handle on one segment, used inside a collector process via SharedTransitionWriter(spec, writer_id).
+# The segment is a ring: after `capacity` rows the oldest ones are overwritten.
+class SharedTransitionWriter(object):
+    def __init__(self, spec, writer_id, shm=None):
+        self.spec = spec
+        self.writer_id = writer_id
+        self.owns_shm = shm is None
+        self.shm = shared_memory.SharedMemory(name=spec.name) if shm is None else shm
+        views = _column_views(spec, self.shm.buf)
+        self.counts = views['counts']
+        self.states = views['states'][writer_id]
+        self.actions = views['actions'][writer_id]
+        self.rewards = views['rewards'][writer_id]
+        self.next_states = views['next_states'][writer_id]
+        self.dones = views['dones'][writer_id]
+
+    def append(self, state, action, reward, next_state, done):
+        count = self.counts[self.writer_id]
+        ii = count % self.spec.capacity
+        self.states[ii] = state
+        self.actions[ii] = action
+        self.rewards[ii] = reward
+        self.next_states[ii] = next_state
+        self.dones[ii] = done
+        # publish the row only once it is complete
+        self.counts[self.writer_id] = count + 1
+
+    # write a whole slab of rows at once (no wrap-around within the slab)
+    def extend(self, states, actions, rewards, next_states, dones):
+        count = self.counts[self.writer_id]
+        ii = count % self.spec.capacity
+        n = len(dones)
+        assert ii + n <= self.spec.capacity
+        self.states[ii:ii + n] = states
+        self.actions[ii:ii + n] = np.reshape(actions, (n, -1))
+        self.rewards[ii:ii + n] = rewards
+        self.next_states[ii:ii + n] = next_states
+        self.dones[ii:ii + n] = dones
+        self.counts[self.writer_id] = count + n
+
+    def close(self):
+        self.counts = self.states = self.actions = self.rewards = self.next_states = self.dones = None
+        if self.owns_shm:
+            self.shm.close()
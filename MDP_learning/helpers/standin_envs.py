@@ -0,0 +1,133 @@
+from collections import namedtuple
+
+import numpy as np
+from gym import spaces
+
+Spec = namedtuple('Spec', ['id', 'timestep_limit'])
+
+
+# Deterministic pure-NumPy environments with the observation and action shapes of the ones the
+# collection code is run on, for measuring collection without MuJoCo, Atari or the particle envs.
+# The dynamics are a fixed random linear map squashed with tanh; episodes end after episode_length steps.
+class StandInEnv(object):
+    def __init__(self, name, obs_size, action_space, episode_length, seed=0):
+        self.spec = Spec(name, episode_length)
+        self.observation_space = spaces.Box(low=-1.0, high=1.0, shape=(obs_size,))
+        self.action_space = action_space
+        self.episode_length = episode_length
+        rng = np.random.RandomState(seed)
+        self.transition = rng.normal(scale=1. / np.sqrt(obs_size), size=(obs_size, obs_size))
+        if isinstance(action_space, spaces.Discrete):
+            self.action_effect = rng.normal(size=(action_space.n, obs_size))
+        else:
+            self.action_effect = rng.normal(size=(sum(action_space.shape), obs_size))
+        self.initial = rng.uniform(-.1, .1, size=obs_size)
+        self.state = None
+        self.t = 0
+
+    def seed(self, seed=None):
+        return [seed]
+
+    def reset(self):
+        self.state = self.initial.copy()
+        self.t = 0
+        return self.state
+
+    def step(self, action):
+        if isinstance(self.action_space, spaces.Discrete):
+            push = self.action_effect[int(action)]
+        else:
+            push = np.dot(np.ravel(action), self.action_effect)
+        self.state = np.tanh(np.dot(self.state, self.transition) + push)
+        self.t += 1
+        return self.state, float(self.state[0]), self.t >= self.episode_length, {}
+
+
+# Atari-shaped stand-in: (210, 160, 3) uint8 frames cycled from a fixed bank, Discrete actions
+class StandInAtariEnv(object):
+    def __init__(self, name='Breakout', n_actions=4, episode_length=200, n_frames=64, seed=0):
+        self.spec = Spec(name, episode_length)
+        self.observation_space = spaces.Box(low=0, high=255, shape=(210, 160, 3))
+        self.action_space = spaces.Discrete(n_actions)
+        self.episode_length = episode_length
+        self.frames = np.random.RandomState(seed).randint(0, 256, size=(n_frames, 210, 160, 3)).astype(np.uint8)
+        self.t = 0
+
+    def seed(self, seed=None):
+        return [seed]
+
+    def reset(self):
+        self.t = 0
+        return self.frames[0]
+
+    def step(self, action):
+        self.t += 1
+        return self.frames[(self.t + int(action)) % len(self.frames)], float(action == 1), \
+            self.t >= self.episode_length, {}
+
+
+class StandInAction(object):
+    def __init__(self, dim_p):
+        self.u = np.zeros(dim_p)
+        self.c = None
+
+
+class StandInAgent(object):
+    def __init__(self, dim_p):
+        self.movable = True
+        self.silent = True
+        self.action = StandInAction(dim_p)
+
+
+# Particle-env-shaped stand-in with the attributes multi.py and policies.py read from a MultiAgentEnv:
+# n agents, per-agent Box observations and Discrete(5) one-hot movement actions, no communication.
+class StandInParticleEnv(object):
+    def __init__(self, name='simple', n_agents=1, obs_size=4, episode_length=25, seed=0):
+        self.spec = Spec(name, episode_length)
+        self.n = n_agents
+        self.world = namedtuple('World', ['dim_p', 'dim_c'])(2, 2)
+        self.agents = [StandInAgent(self.world.dim_p) for _ in range(n_agents)]
+        self.discrete_action_input = False
+        self.discrete_action_space = True
+        self.observation_space = [spaces.Box(low=-np.inf, high=np.inf, shape=(obs_size,)) for _ in range(n_agents)]
+        self.action_space = [spaces.Discrete(self.world.dim_p * 2 + 1) for _ in range(n_agents)]
+        self.episode_length = episode_length
+        rng = np.random.RandomState(seed)
+        self.transition = rng.normal(scale=1. / np.sqrt(obs_size), size=(obs_size, obs_size))
+        self.position_effect = rng.normal(size=(self.world.dim_p, obs_size))
+        self.initial = rng.uniform(-1, 1, size=(n_agents, obs_size))
+        self.obs = None
+        self.t = 0
+
+    def reset(self):
+        self.obs = self.initial.copy()
+        self.t = 0
+        return list(self.obs)
+
+    def step(self, act_n):
+        for agent, action in zip(self.agents, act_n):
+            # one-hot (noop, +x, -x, +y, -y) as in the particle env's _set_action
+            agent.action.u[0] = action[1] - action[2]
+            agent.action.u[1] = action[3] - action[4]
+        moves = np.array([agent.action.u for agent in self.agents])
+        self.obs = np.tanh(np.dot(self.obs, self.transition) + np.dot(moves, self.position_effect))
+        self.t += 1
+        done = self.t >= self.episode_length
+        return list(self.obs), list(-np.abs(self.obs[:, 0])), [done] * self.n, {'n': [{}] * self.n}
+
+
+# the stand-ins for the environments the experiments use, by name
+def make_standin(name):
+    if name == 'Swimmer':
+        return StandInEnv('Swimmer-v2', 8, spaces.Box(low=-1.0, high=1.0, shape=(2,)), 1000)
+    if name == 'Hopper':
+        return StandInEnv('Hopper-v2', 11, spaces.Box(low=-1.0, high=1.0, shape=(3,)), 50)
+    if name == 'CartPole':
+        return StandInEnv('CartPole-v1', 4, spaces.Discrete(2), 20)
+    if name == 'Breakout':
+        return StandInAtariEnv('BreakoutDeterministic-v4')
+    if name == 'simple':
+        return StandInParticleEnv('simple', 1, 4)
+    if name == 'simple_spread':
+        return StandInParticleEnv('simple_spread', 3, 18)
+    raise ValueError("No stand-in environment for {}".format(name))
@@ -0,0 +1,34 @@
+import gym
+import numpy as np
+
+
+# K copies of a gym environment stepped in lockstep.
+# Copies that finish an episode are reset right away: step() returns the true next states
+# and dones of the tick, while `states` holds what the next tick starts from.
+class VecEnv(object):
+    def __init__(self, envs):
+        self.envs = list(envs)
+        self.n_envs = len(self.envs)
+        self.action_space = self.envs[0].action_space
+        self.observation_space = self.envs[0].observation_space
+        self.states = None
+
+    # the given environment plus n_envs - 1 new instances of the same gym id
+    @classmethod
+    def copies(cls, environment, n_envs):
+        return cls([environment] + [gym.make(environment.spec.id) for _ in range(n_envs - 1)])
+
+    def reset(self):
+        self.states = np.array([env.reset() for env in self.envs])
+        return self.states
+
+    def step(self, actions):
+        results = [env.step(action) for env, action in zip(self.envs, actions)]
+        next_states = np.array([r[0] for r in results])
+        rewards = np.array([r[1] for r in results], dtype=np.float32)
+        dones = np.array([r[2] for r in results], dtype=np.bool_)
+
+        self.states = next_states.copy()
+        for ii in np.flatnonzero(dones):
+            self.states[ii] = self.envs[ii].reset()
+        return next_states, rewards, dones
@@ -0,0 +1,49 @@
+import numpy as np
+from keras.utils import Sequence
+
+
+# RNN training windows gathered per minibatch instead of materialized as one [N, L, D] tensor.
+# `gather(starts)` returns the (x, y) windows for an array of window starts, e.g. a memory's
+# window_batch; only the starts are kept, so memory stays O(N) whatever the sequence length.
+# Windows are reshuffled after every epoch unless shuffle is off.
+class WindowSequence(Sequence):
+    def __init__(self, gather, starts, minibatch_size=32, shuffle=True):
+        self.gather = gather
+        self.starts = np.asarray(starts)
+        self.minibatch_size = minibatch_size
+        self.shuffle = shuffle
+        self.order = np.random.permutation(self.starts) if shuffle else self.starts
+
+    def __len__(self):
+        return -(-len(self.starts) // self.minibatch_size)
+
+    def __getitem__(self, idx):
+        return self.gather(self.order[idx * self.minibatch_size:(idx + 1) * self.minibatch_size])
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.order = np.random.permutation(self.starts)
+
+    # (training, validation) sequences, the last validation_split of the windows for validation
+    # like keras' validation_split, the validation windows in order
+    def split(self, validation_split):
+        n_train = int(len(self.starts) * (1. - validation_split))
+        return WindowSequence(self.gather, self.starts[:n_train], self.minibatch_size, self.shuffle), \
+            WindowSequence(self.gather, self.starts[n_train:], self.minibatch_size, shuffle=False)
+
+    # all targets in window order, gathered minibatch by minibatch
+    def targets(self):
+        return np.concatenate([self.gather(self.starts[jj:jj + self.minibatch_size])[1]
+                               for jj in range(0, len(self.starts), self.minibatch_size)])
+
+
+# model.fit over a WindowSequence with a validation_split of its windows
+def fit_windows(model, windows, epochs, steps_per_epoch=None, validation_split=0.1, callbacks=None, verbose=1):
+    train, validation = windows.split(validation_split)
+    return model.fit_generator(train,
+                               steps_per_epoch=steps_per_epoch or len(train),
+                               epochs=epochs,
+                               validation_data=validation if len(validation) else None,
+                               validation_steps=len(validation) if len(validation) else None,
+                               callbacks=callbacks,
+                               verbose=verbose)
@@ -2,16 +2,18 @@ import MDP_learning.multi_agent.policies as MAPolicies
 from MDP_learning.helpers import build_models
 from MDP_learning.helpers.logging_model_learner import LoggingModelLearner
 from MDP_learning.helpers.model_evaluation import sk_eval
+from MDP_learning.multi_agent.memory import MultiAgentMemory
+from MDP_learning.single_agent.preprocessing import rnn_valid_starts
+from MDP_learning.helpers.window_sequence import WindowSequence, fit_windows
 
-from collections import deque
-import time
 import numpy as np
 
 
 class ModelLearner(LoggingModelLearner):
     def __init__(self, environment, agent_id, action_size,
                  mem_size=3000, epochs=4, learning_rate=.001,
-                 sequence_length=0, write_tboard=True, envname=None, net_depth=2):
+                 sequence_length=0, write_tboard=True, envname=None, net_depth=2, memory=None,
+                 joined_actions=False):
         super().__init__(environment, sequence_length,
                          write_tboard=write_tboard,
                          out_dir_add=
@@ -26,17 +28,16 @@ class ModelLearner(LoggingModelLearner):
         self.learn_transitions = False
         self.learn_rewards = False
         self.learn_positions = True
+        self.joined_actions = joined_actions
 
-        self.done_memory = deque(maxlen=mem_size)
-        if self.learn_transitions:
-            self.x_memory = deque(maxlen=mem_size)
-            self.next_obs_memory = deque(maxlen=mem_size)
-        if self.learn_rewards:
-            self.obs_memory = deque(maxlen=mem_size)
-            self.reward_memory = deque(maxlen=mem_size)
-        if self.learn_positions:
-            self.vel_rew_memory = deque(maxlen=mem_size)
-            self.ent_pos_memory = deque(maxlen=mem_size)
+        # the memory is shared by all local learners of a MultiAgentModelLearner,
+        # a standalone learner keeps one for its own agent only
+        if memory is None:
+            memory = MultiAgentMemory(mem_size, [environment.observation_space[agent_id].shape[0]], [action_size])
+            self.mem_agent = 0
+        else:
+            self.mem_agent = agent_id
+        self.memory = memory
 
         self.agent_id = agent_id
         self.policy = MAPolicies.RandomPolicy(environment, self.agent_id)
@@ -88,58 +89,74 @@ class ModelLearner(LoggingModelLearner):
     def get_action(self, obs_n):
         return self.policy.action(obs_n[self.agent_id])
 
+    # only for a standalone learner, a shared memory is filled by MultiAgentModelLearner
     def append_to_mem(self, obs, act, reward, obs_next, done):
-        # TODO is there any point in learning done in this environment
-        self.done_memory.append([done])
-
-        if self.learn_transitions:
-            self.x_memory.append(np.concatenate((obs, act)))
-            self.next_obs_memory.append(obs_next)
-
-        if self.learn_rewards:
-            self.obs_memory.append(obs)
-            # self.reward_memory.append([-np.sqrt(-reward)])
-            self.reward_memory.append([reward])
-
-        if self.learn_positions:
-            self.vel_rew_memory.append(np.hstack((obs[:2], reward)))
-            self.ent_pos_memory.append(obs[2:])
+        self.memory.append([obs], [act], [reward], [obs_next], [done])
 
     def clear_mem(self):
-        # TODO brittle
-        self.done_memory.clear()
-        if self.learn_transitions:
-            self.x_memory.clear()
-            self.next_obs_memory.clear()
-        if self.learn_rewards:
-            self.obs_memory.clear()
-            self.reward_memory.clear()
-        if self.learn_positions:
-            self.vel_rew_memory.clear()
-            self.ent_pos_memory.clear()
-
-    def setup_batch_for_RNN(self, input_batch, signal, done):
-        array_size = input_batch.shape[0] - self.sequence_length
-        actual_size = 0
-
-        d = np.array(done)
-        seq = np.zeros((array_size, self.sequence_length, input_batch.shape[1]), dtype=np.float32)
-        output = np.zeros((array_size, signal.shape[1]), dtype=np.float32)
-
-        for jj in range(1, array_size, max(1, self.sequence_length)):
-            # if jj % 10000 == 1:
-            #     print('Filling data for RNN: {} of {} ({} w/o terminals)'.format(jj, array_size, actual_size))
-            # NO intermediate terminals
-            if not d[jj:jj + self.sequence_length - 1, :].any():
-                seq[actual_size, :, :] = input_batch[np.newaxis, jj:jj + self.sequence_length, :]
-                output[actual_size, :] = signal[jj + self.sequence_length, :]
-                actual_size += 1
-
-        seq.resize((actual_size, self.sequence_length, input_batch.shape[1]))
-        output.resize((actual_size, signal.shape[1]))
+        self.memory.clear()
+
+    # training inputs and signals derived from this agent's column of the memory
+    def transition_data(self):
+        act = self.memory.joined_actions() if self.joined_actions else self.memory.agent_actions(self.mem_agent)
+        return np.hstack((self.memory.agent_obs(self.mem_agent), act)), self.memory.agent_next_obs(self.mem_agent)
+
+    def reward_data(self):
+        return self.memory.agent_obs(self.mem_agent), self.memory.agent_rewards(self.mem_agent)[:, np.newaxis]
+
+    def position_data(self):
+        obs = self.memory.agent_obs(self.mem_agent)
+        rewards = self.memory.agent_rewards(self.mem_agent)
+        return np.hstack((obs[:, :2], rewards[:, np.newaxis])), obs[:, 2:]
+
+    # windows w/o intermediate terminals come from the episode index the memory keeps, or from the
+    # done flags of the rows when they are given, keeping one window every sequence_length steps, starting at 1
+    def rnn_starts(self, n_rows, done=None):
+        array_size = n_rows - self.sequence_length
+        if done is None:
+            jj = self.memory.valid_starts(self.mem_agent, self.sequence_length)
+        else:
+            jj = rnn_valid_starts(np.asarray(done).reshape(n_rows, -1).any(axis=1), self.sequence_length)
+        return jj[(jj >= 1) & (jj < array_size) & ((jj - 1) % max(1, self.sequence_length) == 0)]
+
+    def setup_batch_for_RNN(self, input_batch, signal, done=None):
+        jj = self.rnn_starts(input_batch.shape[0], done)
+
+        seq = input_batch[jj[:, np.newaxis] + np.arange(self.sequence_length)].astype(np.float32)
+        output = signal[jj + self.sequence_length].astype(np.float32)
         print('Done filling the data!')
         return seq, output
 
+    # the same windows gathered one minibatch at a time instead of as one [N, L, D] tensor
+    def rnn_windows(self, input_batch, signal, minibatch_size, done=None, shuffle=True):
+        def gather(starts):
+            return (input_batch[starts[:, np.newaxis] + np.arange(self.sequence_length)].astype(np.float32),
+                    signal[starts + self.sequence_length].astype(np.float32))
+
+        return WindowSequence(gather, self.rnn_starts(input_batch.shape[0], done), minibatch_size, shuffle=shuffle)
+
+    # fit a model on rows of inputs and signals, or on the windows over them with an RNN, and log its R2
+    def fit_model(self, model, input_data, train_signal, minibatch_size, callbacks, r2_file):
+        if self.useRNN:
+            history = fit_windows(model, self.rnn_windows(input_data, train_signal, minibatch_size),
+                                  epochs=self.net_train_epochs,
+                                  validation_split=0.1,
+                                  callbacks=callbacks,
+                                  verbose=1)
+            windows = self.rnn_windows(input_data, train_signal, minibatch_size, shuffle=False)
+            sk_eval(model, windows, windows.targets(), r2_file)
+            return history
+
+        history = model.fit(input_data,
+                            train_signal,
+                            batch_size=minibatch_size,
+                            epochs=self.net_train_epochs,
+                            validation_split=0.1,
+                            callbacks=callbacks,
+                            verbose=1)
+        sk_eval(model, input_data, train_signal, r2_file)
+        return history
+
     # if this becomes a bottle-neck again this could be transformed into a parallel version
     # from joblib import Parallel, delayed
     # from joblib.pool import has_shareable_memory
@@ -157,7 +174,7 @@ class ModelLearner(LoggingModelLearner):
             if jj % 10000 == 1:
                 print('Filling data for RNN: {} of {} ({} w/o terminals)'.format(jj, array_length, actual_size))
             # NO intermediate terminals
-            if not d[jj:jj + self.sequence_length - 1, :].any():
+            if not d[jj:jj + self.sequence_length - 1].any():
                 mask[jj] = True
                 seq[jj, :, :] = input_batch[np.newaxis, jj:jj + self.sequence_length, :]
                 output[jj, :] = signal[jj + self.sequence_length, :]
@@ -170,42 +187,14 @@ class ModelLearner(LoggingModelLearner):
 
     def train_models(self, minibatch_size=32):
         if self.learn_transitions:  # predictiong state transitions
-            if self.useRNN:
-                now = time.time()
-                input_data, train_signal = self.setup_batch_for_RNN(np.array(self.x_memory),
-                                                                    np.array(self.next_obs_memory),
-                                                                    done=self.done_memory)
-                print("setup_batch_for_RNN took: {}".format(time.time() - now))
-            else:
-                input_data = np.array(self.x_memory)
-                train_signal = np.array(self.next_obs_memory)
-
-            history = self.tmodel.fit(input_data,
-                                      train_signal,
-                                      batch_size=minibatch_size,
-                                      epochs=self.net_train_epochs,
-                                      validation_split=0.1,
-                                      callbacks=self.Ttensorboard,
-                                      verbose=1)
-            sk_eval(self.tmodel, input_data, train_signal, '{}/tmodel_R2.txt'.format(self.out_dir))
+            input_data, train_signal = self.transition_data()
+            history = self.fit_model(self.tmodel, input_data, train_signal, minibatch_size, self.Ttensorboard,
+                                     '{}/tmodel_R2.txt'.format(self.out_dir))
 
         if self.learn_rewards:  # predicting rewards from observations
-            if self.useRNN:
-                input_data, train_signal = self.setup_batch_for_RNN(np.array(self.obs_memory),
-                                                                    np.array(self.reward_memory),
-                                                                    done=self.done_memory)
-            else:
-                input_data = np.array(self.obs_memory)
-                train_signal = np.array(self.reward_memory)
-
-            history = self.rmodel.fit(input_data,
-                                      train_signal,
-                                      batch_size=minibatch_size,
-                                      epochs=self.net_train_epochs,
-                                      validation_split=0.1,
-                                      callbacks=self.Rtensorboard,
-                                      verbose=1)
-            sk_eval(self.rmodel, input_data, train_signal, '{}/rmodel_R2.txt'.format(self.out_dir))
+            input_data, train_signal = self.reward_data()
+            history = self.fit_model(self.rmodel, input_data, train_signal, minibatch_size, self.Rtensorboard,
+                                     '{}/rmodel_R2.txt'.format(self.out_dir))
 
             # DEBUG
             if False:
@@ -216,34 +205,21 @@ class ModelLearner(LoggingModelLearner):
 
                 fig = plt.figure()
                 ax = fig.add_subplot(111, projection='3d')
-                ax.scatter(np.array(self.obs_memory)[:, 2],
-                           np.array(self.obs_memory)[:, 3],
-                           np.array(self.reward_memory),
+                obs, rewards = self.reward_data()
+                ax.scatter(obs[:, 2],
+                           obs[:, 3],
+                           rewards,
                            c='b', marker='^')
 
-                ax.scatter(np.array(self.obs_memory)[:, 2],
-                           np.array(self.obs_memory)[:, 3],
-                           self.rmodel.predict(np.array(self.obs_memory)),
+                ax.scatter(obs[:, 2],
+                           obs[:, 3],
+                           self.rmodel.predict(obs),
                            c='r', marker='o')
                 plt.show()
 
         if self.learn_positions:  # Predicting relative position of entities from movement and rewards
-            if self.useRNN:
-                input_data, train_signal = self.setup_batch_for_RNN(np.array(self.vel_rew_memory),
-                                                                    np.array(self.ent_pos_memory),
-                                                                    done=self.done_memory)
-            else:
-                input_data = np.array(self.vel_rew_memory)
-                train_signal = np.array(self.ent_pos_memory)
-
-            history = self.dmodel.fit(input_data,
-                                      train_signal,
-                                      batch_size=minibatch_size,
-                                      epochs=self.net_train_epochs,
-                                      validation_split=0.1,
-                                      callbacks=self.Dtensorboard,
-                                      verbose=1)
-
-            sk_eval(self.dmodel, input_data, train_signal, '{}/dmodel_R2.txt'.format(self.out_dir))
+            input_data, train_signal = self.position_data()
+            history = self.fit_model(self.dmodel, input_data, train_signal, minibatch_size, self.Dtensorboard,
+                                     '{}/dmodel_R2.txt'.format(self.out_dir))
 
         self.save()
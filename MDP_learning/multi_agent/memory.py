@@ -0,0 +1,106 @@
+import numpy as np
+
+from MDP_learning.helpers.episode_index import EpisodeIndex
+
+
+# One preallocated memory for all agents of a MultiAgentEnv, written once per env step.
+# Columns are [T, n_agents, ...] blocks padded to the largest observation/action size;
+# each agent's training data is read back as slices of its own agent column.
+# Like the deques it replaces it keeps the last `capacity` steps.
+class MultiAgentMemory(object):
+    def __init__(self, capacity, obs_sizes, action_sizes):
+        self.capacity = capacity
+        self.n_agents = len(obs_sizes)
+        self.obs_sizes = list(obs_sizes)
+        self.action_sizes = list(action_sizes)
+        self.uniform = len(set(obs_sizes)) == 1 and len(set(action_sizes)) == 1
+
+        self.obs = np.zeros((capacity, self.n_agents, max(obs_sizes)), dtype=np.float32)
+        self.next_obs = np.zeros((capacity, self.n_agents, max(obs_sizes)), dtype=np.float32)
+        self.actions = np.zeros((capacity, self.n_agents, max(max(action_sizes), 1)), dtype=np.float32)
+        self.rewards = np.zeros((capacity, self.n_agents), dtype=np.float32)
+        self.dones = np.zeros((capacity, self.n_agents), dtype=np.bool_)
+
+        self.top = 0
+        self.size = 0
+        self.episodes = [EpisodeIndex() for _ in range(self.n_agents)]
+
+    def __len__(self):
+        return self.size
+
+    def append(self, obs_n, act_n, reward_n, obs_n_next, done_n):
+        ii = self.top
+        if self.uniform:
+            self.obs[ii] = obs_n
+            self.next_obs[ii] = obs_n_next
+            self.actions[ii] = np.reshape(act_n, (self.n_agents, -1))
+        else:
+            for jj in range(self.n_agents):
+                self.obs[ii, jj, :self.obs_sizes[jj]] = obs_n[jj]
+                self.next_obs[ii, jj, :self.obs_sizes[jj]] = obs_n_next[jj]
+                action = np.ravel(act_n[jj])
+                if len(action) != self.action_sizes[jj]:
+                    raise ValueError("Agent {} acted with {} values, its action size is {}".format(
+                        jj, len(action), self.action_sizes[jj]))
+                self.actions[ii, jj, :self.action_sizes[jj]] = action
+        self.rewards[ii] = reward_n
+        self.dones[ii] = done_n
+        self.top = (ii + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        for jj in range(self.n_agents):
+            self.episodes[jj].step(done_n[jj])
+
+    def clear(self):
+        self.top = 0
+        self.size = 0
+        for index in self.episodes:
+            index.clear()
+
+    # steps in the order they were written, a view unless the ring has wrapped mid-lap
+    def ordered(self, column):
+        if self.size < self.capacity or self.top == 0:
+            return column[:self.size]
+        return np.concatenate((column[self.top:], column[:self.top]))
+
+    # strided [T, ...] views of one agent's data
+    def agent_obs(self, agent_id):
+        return self.ordered(self.obs)[:, agent_id, :self.obs_sizes[agent_id]]
+
+    def agent_next_obs(self, agent_id):
+        return self.ordered(self.next_obs)[:, agent_id, :self.obs_sizes[agent_id]]
+
+    def agent_actions(self, agent_id):
+        return self.ordered(self.actions)[:, agent_id, :self.action_sizes[agent_id]]
+
+    def agent_rewards(self, agent_id):
+        return self.ordered(self.rewards)[:, agent_id]
+
+    def agent_dones(self, agent_id):
+        return self.ordered(self.dones)[:, agent_id]
+
+    # the actions of all agents side by side, what each agent sees with joined actions
+    def joined_actions(self):
+        return np.hstack([self.agent_actions(jj) for jj in range(self.n_agents)])
+
+    def valid_starts(self, agent_id, sequence_length):
+        index = self.episodes[agent_id]
+        return index.valid_starts(sequence_length, index.total - self.size)
+
+    # write a slab of T steps at once, columns laid out like the memory's ([T, n_agents, ...], padded)
+    def extend(self, obs, actions, rewards, next_obs, dones):
+        n = len(dones)
+        rows = (self.top + np.arange(n)) % self.capacity
+        self.obs[rows, :, :obs.shape[2]] = obs
+        self.next_obs[rows, :, :next_obs.shape[2]] = next_obs
+        self.actions[rows, :, :actions.shape[2]] = actions
+        self.rewards[rows] = rewards
+        self.dones[rows] = dones
+        self.top = (self.top + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        for jj in range(self.n_agents):
+            self.episodes[jj].extend(dones[:, jj])
+
+    # end the current episode of every agent, e.g. where the environment was reset without a terminal
+    def split(self):
+        for index in self.episodes:
+            index.split()
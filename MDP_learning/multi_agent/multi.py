@@ -1,28 +1,36 @@
 from MDP_learning.multi_agent import make_env2
 import MDP_learning.multi_agent.policies as MAPolicies
 import MDP_learning.multi_agent.ModelLearner as ModelLearner
+from MDP_learning.multi_agent.memory import MultiAgentMemory
+from MDP_learning.multi_agent.parallel_fill import fill_episodes
 from MDP_learning.helpers.logging_model_learner import LoggingModelLearner
 
+import argparse
 import random
 import numpy as np
-from collections import deque
 
 
 class MultiAgentModelLearner(LoggingModelLearner):
     def __init__(self, environment, mem_size=3000, epochs=4, learning_rate=.001,
-                 sequence_length=0, write_tboard=True, scenario_name=None, net_depth=2):
+                 sequence_length=0, write_tboard=True, scenario_name=None, net_depth=2, n_workers=1,
+                 collect_seed=None):
         super().__init__(environment, sequence_length,
                          write_tboard=write_tboard,
                          out_dir_add='scenario_name{}'.format(scenario_name) if scenario_name is not None else None)
         self.render = False
         self.joined_actions = False
-        self.gather_joined_mem = False
         self.random_resets = True
         # how likely a random reset is (1 is resetting always)
         self.reset_randomrange = 3 if sequence_length > 0 else int(mem_size / 100) + 2
         self.mem_size = mem_size
-        self.x_memory = deque(maxlen=mem_size if self.gather_joined_mem else 1)
-        self.y_memory = deque(maxlen=mem_size if self.gather_joined_mem else 1)
+        # with n_workers > 1 or a collect_seed the memory is filled with whole episodes of
+        # make_env2.make_env(scenario_name) run in worker processes, seeded from (collect_seed, episode index)
+        self.scenario_name = scenario_name
+        self.n_workers = n_workers
+        self.collect_seed = collect_seed
+        self.episodes_collected = 0
+        if (n_workers > 1 or collect_seed is not None) and scenario_name is None:
+            raise ValueError("Parallel or seeded collection needs the scenario_name to make its environments")
 
         # if all actions are visible we need to sum them
         action_compound_size = 0
@@ -31,6 +39,14 @@ class MultiAgentModelLearner(LoggingModelLearner):
                 size_act, _ = MAPolicies.get_action_and_comm_actual_size(self.env, ii)
                 action_compound_size += size_act
 
+        # one memory for all agents, each local learner reads its own agent's slice of it
+        self.memory = MultiAgentMemory(mem_size,
+                                       [self.env.observation_space[ii].shape[0] for ii in range(self.env.n)],
+                                       [MAPolicies.get_action_and_comm_actual_size(self.env, ii)[0]
+                                        for ii in range(self.env.n)])
+
+        self.policy = MAPolicies.BatchRandomPolicy(self.env)
+
         self.local_learners = []
         for ii in range(self.env.n):
             size_act, _ = MAPolicies.get_action_and_comm_actual_size(self.env, ii)
@@ -42,14 +58,14 @@ class MultiAgentModelLearner(LoggingModelLearner):
                                           sequence_length=sequence_length,
                                           write_tboard=write_tboard,
                                           envname=scenario_name,
-                                          net_depth=net_depth))
+                                          net_depth=net_depth,
+                                          memory=self.memory,
+                                          joined_actions=self.joined_actions))
 
-    # get action from model using random policy
+    # get the actions of all agents from one batched random policy
     def get_action(self, obs_n):
-        act_n = []
-        for ii, ll in enumerate(self.local_learners):
-            act_n.append(ll.get_action(obs_n[ii]))
-        return act_n
+        self.policy.action(obs_n)
+        return self.policy.action_n()
 
     def get_transition(self, act_n):
         # step environment
@@ -59,11 +75,17 @@ class MultiAgentModelLearner(LoggingModelLearner):
         return obs_n_next, act_n_real, reward_n, done_n, info_n
 
     def fill_memory(self):
+        if self.n_workers > 1 or self.collect_seed is not None:
+            self.episodes_collected += fill_episodes(
+                self.scenario_name, self.memory, self.mem_size, self.n_workers,
+                sequence_length=self.sequence_length,
+                reset_randomrange=self.reset_randomrange if self.random_resets else None,
+                base_seed=self.collect_seed if self.collect_seed is not None else np.random.randint(2 ** 31 - 1),
+                first_episode=self.episodes_collected)
+            return
+
         # execution loop
-        self.x_memory.clear()
-        self.y_memory.clear()
-        for ll in self.local_learners:
-            ll.clear_mem()
+        self.memory.clear()
 
         obs_n = self.env.reset()
         for ii in range(self.mem_size):
@@ -77,17 +99,8 @@ class MultiAgentModelLearner(LoggingModelLearner):
                     and self.random_resets and random.randrange(self.reset_randomrange) == 0:
                 done_n = [True for _ in self.env.agents]
 
-            # save the sample <s, a, r, s'>
-            self.x_memory.append((np.array(obs_n).flatten(), np.array(act_n_real).flatten()))
-            self.y_memory.append((np.array(reward_n).flatten(), np.array(obs_n_next).flatten()))
-
-            # hand them to the individual learners
-            for jj, ll in enumerate(self.local_learners):
-                ll.append_to_mem(obs_n[jj],
-                                 np.array(act_n_real).flatten() if self.joined_actions else act_n_real[jj],
-                                 reward_n[jj],
-                                 obs_n_next[jj],
-                                 done_n[jj])
+            # save the sample <s, a, r, s'> of all agents at once
+            self.memory.append(obs_n, act_n_real, reward_n, obs_n_next, done_n)
 
             obs_n = obs_n_next
 
@@ -118,6 +131,11 @@ class MultiAgentModelLearner(LoggingModelLearner):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    # fill the memories with that many worker processes, as whole episodes
+    parser.add_argument('--n-workers', type=int, default=1)
+    args = parser.parse_args()
+
     if False:
         s = 15
         env_name = 'simple'
@@ -139,5 +157,6 @@ if __name__ == "__main__":
                                                     sequence_length=s,
                                                     epochs=100,
                                                     net_depth=nd,
-                                                    learning_rate=.001)
+                                                    learning_rate=.001,
+                                                    n_workers=args.n_workers)
                     canary.run(rounds=1)
@@ -0,0 +1,114 @@
+import multiprocessing
+import random
+from collections import deque
+
+import numpy as np
+
+from MDP_learning.multi_agent import make_env2
+import MDP_learning.multi_agent.policies as MAPolicies
+from MDP_learning.single_agent.parallel_collect import episode_seed, InProcessResult
+
+_worker_env = None  # one MultiAgentEnv per pool process, made by init_episode_worker
+_worker_policy = None
+
+
+def init_episode_worker(scenario_name):
+    global _worker_env, _worker_policy
+    _worker_env = make_env2.make_env(scenario_name)
+    _worker_policy = MAPolicies.BatchRandomPolicy(_worker_env)
+
+
+# one [n_agents, max(sizes)] row of per-agent vectors, zero padded
+def pad(values, sizes):
+    row = np.zeros((len(sizes), max(max(sizes), 1)), dtype=np.float32)
+    for jj, size in enumerate(sizes):
+        row[jj, :size] = values[jj][:size]
+    return row
+
+
+# Run one episode of the random policies for at most max_steps steps, seeded from (base_seed, episode).
+# The episode ends on a terminal of any agent or on a random reset, drawn every sequence_length steps
+# with probability 1 / reset_randomrange (as in MultiAgentModelLearner.fill_memory).
+# Returns [T, n_agents, ...] columns padded to the largest observation/action size.
+# The policy draws from the episode's own RNG; the scenarios' reset_world draws from the global np.random,
+# which is seeded for the episode and restored afterwards.
+def run_episode(args):
+    base_seed, episode, max_steps, sequence_length, reset_randomrange = args
+    seed = episode_seed(base_seed, episode)
+    global_state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        return episode_columns(seed, max_steps, sequence_length, reset_randomrange)
+    finally:
+        np.random.set_state(global_state)
+
+
+def episode_columns(seed, max_steps, sequence_length, reset_randomrange):
+    env = _worker_env
+    _worker_policy.rng = np.random.RandomState(seed)
+    resets = random.Random(seed)
+
+    obs_sizes = [env.observation_space[ii].shape[0] for ii in range(env.n)]
+    action_sizes = [MAPolicies.get_action_and_comm_actual_size(env, ii)[0] for ii in range(env.n)]
+    obs, actions, rewards, next_obs, dones = [], [], [], [], []
+
+    obs_n = env.reset()
+    for t in range(max_steps):
+        _worker_policy.action(obs_n)
+        act_n = _worker_policy.action_n()
+        obs_n_next, reward_n, done_n, info_n = env.step(act_n)
+        if (t % sequence_length == 0 if sequence_length > 0 else True) \
+                and reset_randomrange is not None and resets.randrange(reset_randomrange) == 0:
+            done_n = [True for _ in env.agents]
+        obs.append(pad(obs_n, obs_sizes))
+        next_obs.append(pad(obs_n_next, obs_sizes))
+        actions.append(pad([np.ravel(agent.action.u) for agent in env.agents], action_sizes))
+        rewards.append(reward_n)
+        dones.append(done_n)
+        if any(done_n):
+            break
+        obs_n = obs_n_next
+    return (np.array(obs), np.array(actions), np.array(rewards, dtype=np.float32), np.array(next_obs),
+            np.array(dones, dtype=np.bool_))
+
+
+# Fill `memory` (a MultiAgentMemory, cleared first) with n_steps steps of make_env2.make_env(scenario_name),
+# as whole episodes first_episode, first_episode + 1, ... (the last one cut at n_steps) run by n_workers
+# pool processes. Episodes are merged in index order, so the data is the same for any n_workers.
+# An episode boundary is recorded for every agent where the environment was reset.
+# Returns the number of episodes used, so the next round can continue from first_episode + n_episodes.
+def fill_episodes(scenario_name, memory, n_steps, n_workers, sequence_length=0, reset_randomrange=None,
+                  base_seed=0, first_episode=0):
+    memory.clear()
+    if n_workers > 1:
+        pool = multiprocessing.get_context('spawn').Pool(n_workers, initializer=init_episode_worker,
+                                                          initargs=(scenario_name,))
+
+        def submit(job):
+            return pool.apply_async(run_episode, (job,))
+    else:
+        pool = None
+        init_episode_worker(scenario_name)
+
+        def submit(job):
+            return InProcessResult(run_episode(job))
+    try:
+        collected = 0
+        episode = first_episode
+        pending = deque()
+        while collected < n_steps:
+            # one episode in flight per worker, each capped at the steps still missing when it is handed out;
+            # an episode is a prefix of its uncapped self, so the cap never changes the merged data
+            while len(pending) < n_workers:
+                pending.append(submit((base_seed, episode + len(pending), n_steps - collected,
+                                       sequence_length, reset_randomrange)))
+            obs, actions, rewards, next_obs, dones = pending.popleft().get()
+            n = min(len(dones), n_steps - collected)
+            memory.extend(obs[:n], actions[:n], rewards[:n], next_obs[:n], dones[:n])
+            memory.split()
+            collected += n
+            episode += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return episode - first_episode
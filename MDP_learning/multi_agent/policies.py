@@ -100,3 +100,77 @@ class RandomPolicy(multiagent.policy.Policy):
                 c = np.random.uniform(low=0.0, high=1.0, size=size_com)
 
         return np.concatenate([u, c])
+
+
+
+# RandomPolicy for all agents of a MultiAgentEnv and n_envs copies of it at once.
+# The action/communication layout of every agent is worked out once; action() then draws all
+# categorical parts with one randint and all continuous parts with one uniform call and writes
+# them into a preallocated [n_envs, n_agents, width] array (overwritten by the next call).
+# Agent ii's action in copy k is actions[k, ii, :widths[ii]], laid out like RandomPolicy.action.
+class BatchRandomPolicy(object):
+    def __init__(self, env, n_envs=1, rng=None):
+        self.n_envs = n_envs
+        self.rng = np.random if rng is None else rng  # e.g. a np.random.RandomState per seeded episode
+        self.n_agents = env.n
+        self.widths = []
+        # (agent, offset, number of choices) of the parts drawn as one-hot vectors and as indices,
+        # (agent, offset, low, high) of the columns drawn uniformly
+        one_hot, index, uniform = [], [], []
+        for ii, agent in enumerate(env.agents):
+            size_act, size_com = get_action_and_comm_input_size(env.action_space[ii], agent)
+            width = 0
+            if agent.movable:
+                if env.discrete_action_input:
+                    index.append((ii, width, size_act))
+                    width += 1
+                elif env.discrete_action_space:
+                    one_hot.append((ii, width, size_act))
+                    width += size_act
+                else:
+                    space = env.action_space[ii]
+                    uniform.extend((ii, width + jj, space.low[jj], space.high[jj]) for jj in range(size_act))
+                    width += size_act
+            if not agent.silent:
+                if env.discrete_action_input:
+                    index.append((ii, width, size_com))
+                    width += 1
+                else:
+                    uniform.extend((ii, width + jj, 0.0, 1.0) for jj in range(size_com))
+                    width += size_com
+            self.widths.append(width)
+
+        self.actions = np.zeros((n_envs, self.n_agents, max(max(self.widths), 1)))
+        self.hot_agents = np.array([p[0] for p in one_hot], dtype=np.intp)
+        self.hot_offsets = np.array([p[1] for p in one_hot], dtype=np.intp)
+        self.hot_sizes = np.array([p[2] for p in one_hot], dtype=np.int64)
+        self.hot_columns = np.zeros(self.actions.shape[1:], dtype=np.bool_)
+        for agent, offset, size in one_hot:
+            self.hot_columns[agent, offset:offset + size] = True
+        self.index_agents = np.array([p[0] for p in index], dtype=np.intp)
+        self.index_offsets = np.array([p[1] for p in index], dtype=np.intp)
+        self.index_sizes = np.array([p[2] for p in index], dtype=np.int64)
+        self.uniform_agents = np.array([p[0] for p in uniform], dtype=np.intp)
+        self.uniform_offsets = np.array([p[1] for p in uniform], dtype=np.intp)
+        self.uniform_low = np.array([p[2] for p in uniform], dtype=np.float64)
+        self.uniform_high = np.array([p[3] for p in uniform], dtype=np.float64)
+        self.envs = np.arange(n_envs)[:, np.newaxis]
+
+    # draw new actions for all agents of all copies, obs is not used
+    def action(self, obs=None):
+        actions = self.actions
+        if len(self.hot_sizes):
+            hot = self.rng.randint(self.hot_sizes, size=(self.n_envs, len(self.hot_sizes)))
+            actions[:, self.hot_columns] = 0.0
+            actions[self.envs, self.hot_agents, self.hot_offsets + hot] = 1.0
+        if len(self.index_sizes):
+            actions[:, self.index_agents, self.index_offsets] = self.rng.randint(
+                self.index_sizes, size=(self.n_envs, len(self.index_sizes)))
+        if len(self.uniform_low):
+            actions[:, self.uniform_agents, self.uniform_offsets] = self.rng.uniform(
+                self.uniform_low, self.uniform_high, size=(self.n_envs, len(self.uniform_low)))
+        return actions
+
+    # the last drawn actions of copy k as the per-agent list the environment's step() takes
+    def action_n(self, k=0):
+        return [self.actions[k, ii, :self.widths[ii]] for ii in range(self.n_agents)]
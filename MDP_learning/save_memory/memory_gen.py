@@ -16,6 +16,10 @@ import matplotlib.pyplot as plt
 from sklearn.preprocessing import Imputer
 from fancyimpute import KNN, SimpleFill, SoftImpute, MICE, IterativeSVD
 
+from MDP_learning.single_agent.dataset import TransitionDatasetWriter, TransitionDataset
+from MDP_learning.single_agent.preprocessing import make_mem_partial_obs
+from MDP_learning.helpers.window_sequence import WindowSequence, fit_windows
+
 '''
 GRID SEARCH RESULT
 Best parameter set was 
@@ -26,7 +30,7 @@ Best parameter set was
 class ModelLearner:
     def __init__(self, observation_space, action_space, data_size=2000000, epochs=5, learning_rate=.001,
                  tmodel_dim_multipliers=(6, 6), tmodel_activations=('relu', 'sigmoid'), sequence_length=1,
-                 partial_obs_rate=0.0):
+                 partial_obs_rate=0.0, spill_path=None, spill_chunk_size=100000):
 
         # get size of state and action from environment
         self.state_size = sum(observation_space.shape)
@@ -47,8 +51,11 @@ class ModelLearner:
         self.partial_obs_rate = partial_obs_rate
 
         # create replay memory using deque
+        # or, with spill_path, stream it into a chunked dataset on disk while collecting
         self.data_size = data_size
         self.memory = deque(maxlen=self.data_size)
+        self.spill_path = spill_path
+        self.spill_chunk_size = spill_chunk_size
 
         # create main model and target model
         if self.useRNN:
@@ -76,6 +83,9 @@ class ModelLearner:
         return environment.action_space.sample()
 
     def refill_mem(self, environment):
+        if self.spill_path is not None:
+            self.spill_mem(environment)
+            return
         state = environment.reset()
         self.memory.clear()
         for i in range(self.data_size):
@@ -89,20 +99,27 @@ class ModelLearner:
             else:
                 state = next_state
 
-    def make_mem_partial_obs(self, memory):
-        masks_states = np.random.choice([np.nan, 1.0], size=(len(memory), self.state_size),
-                                        p=[self.partial_obs_rate, 1 - self.partial_obs_rate])
-        masks_next_states = np.random.choice([np.nan, 1.0], size=(len(memory), self.state_size),
-                                             p=[self.partial_obs_rate, 1 - self.partial_obs_rate])
-        memory[:, self.state_size:self.state_size+1] = memory[:, self.state_size:self.state_size+1]
-        for i in range(len(memory)):
-            if i == 0 or memory[i - 1, -1]:
-                memory[i, :self.state_size] = masks_states[i] * memory[i, :self.state_size]
-                memory[i, self.state_size + self.action_size + 1:-1] = masks_next_states[i] * memory[i, self.state_size + self.action_size + 1:-1]
+    # collect data_size steps into a new shard under spill_path, holding at most one chunk in RAM;
+    # afterwards the memory is the memory-mapped shard
+    def spill_mem(self, environment):
+        writer = TransitionDatasetWriter(self.spill_path, self.state_size, self.action_size,
+                                         chunk_size=self.spill_chunk_size)
+        tags = {'kind': 'FULL', 'refill': len(writer.index['shards'])}
+        stream = writer.stream(**tags)
+        state = environment.reset()
+        for i in range(self.data_size):
+            action = self.get_action(state, environment)
+            next_state, reward, done, info = environment.step(action)
+            stream.append(state, action, reward, next_state, done)
+            if done:
+                state = environment.reset()
             else:
-                memory[i, :self.state_size] = memory[i - 1, self.state_size + self.action_size + 1:-1]
-                memory[i, self.state_size + self.action_size + 1:-1] = masks_next_states[i] * memory[i, self.state_size + self.action_size + 1:-1]
+                state = next_state
+        stream.close()
+        self.memory = TransitionDataset(self.spill_path).store(**tags)
 
+    def make_mem_partial_obs(self, memory):
+        make_mem_partial_obs(memory, self.state_size, self.partial_obs_rate)
 
     def setup_batch_for_RNN(self, batch):
         batch_size = batch.shape[0]
@@ -124,6 +141,42 @@ class ModelLearner:
         return x_seq, y_seq
 
 
+    # endless (s, a) -> s' minibatches over rows [start, stop) of the spilled store,
+    # read one dataset chunk at a time and shuffled within it
+    def spilled_batches(self, minibatch_size, start, stop, shuffle=True):
+        s = self.state_size
+        while True:
+            for chunk in self.memory.iter_chunks(self.spill_chunk_size, start, stop):
+                order = np.random.permutation(len(chunk)) if shuffle else np.arange(len(chunk))
+                for jj in range(0, len(chunk), minibatch_size):
+                    rows = chunk[order[jj:jj + minibatch_size]]
+                    yield rows[:, :s + self.action_size], rows[:, -s - 1:-1]
+
+    def spilled_steps(self, minibatch_size, start, stop):
+        return sum(-(-(min(lo + self.spill_chunk_size, stop) - lo) // minibatch_size)
+                   for lo in range(start, stop, self.spill_chunk_size))
+
+    # train_models for a memory spilled to disk: minibatches are read from the store as they are
+    # needed instead of loading it, the last 10% of the rows (windows) are kept for validation
+    def train_models_spilled(self, minibatch_size):
+        if self.useRNN:
+            windows = WindowSequence(lambda starts: self.memory.window_batch(starts, self.sequence_length),
+                                     self.memory.valid_starts(self.sequence_length), minibatch_size)
+            fit_windows(self.tmodel, windows,
+                        epochs=self.net_train_epochs,
+                        validation_split=0.1,
+                        callbacks=self.Ttensorboard)
+            return
+        split = int(len(self.memory) * 0.9)
+        self.tmodel.fit_generator(self.spilled_batches(minibatch_size, 0, split),
+                                  steps_per_epoch=self.spilled_steps(minibatch_size, 0, split),
+                                  epochs=self.net_train_epochs,
+                                  validation_data=self.spilled_batches(minibatch_size, split, len(self.memory),
+                                                                       shuffle=False),
+                                  validation_steps=self.spilled_steps(minibatch_size, split, len(self.memory)),
+                                  callbacks=self.Ttensorboard,
+                                  verbose=1)
+
     # approximate Transition function
     # state and action is input and successor state is output
     def build_regression_model(self,
@@ -187,9 +240,14 @@ class ModelLearner:
 
     # pick samples randomly from replay memory (with batch_size)
     def train_models(self, minibatch_size=32):
+        if self.spill_path is not None and self.partial_obs_rate == 0:
+            self.train_models_spilled(minibatch_size)
+            return
+        # SoftImpute completes the whole matrix at once, so corrupted memories are always loaded
         memory_arr = np.array(self.memory)
-        file = "memoryBW.npy"
-        np.save(file, memory_arr)
+        if self.spill_path is None:  # spilled memories are on disk already
+            file = "memoryBW.npy"
+            np.save(file, memory_arr)
 
         if self.partial_obs_rate > 0:
             self.make_mem_partial_obs(memory_arr)
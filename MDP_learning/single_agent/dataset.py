@@ -0,0 +1,298 @@
+import json
+import os
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from MDP_learning.helpers.episode_index import EpisodeIndex
+from MDP_learning.single_agent.memory import TransitionMemory
+from MDP_learning.single_agent.missingness import MissingMask
+from MDP_learning.single_agent.transition_store import MmapTransitionStore
+
+COLUMNS = ('states', 'actions', 'rewards', 'next_states', 'dones')
+VECTOR_COLUMNS = ('rewards', 'dones')
+INDEX_FILE = 'index.json'
+
+
+# Chunk compression: the bytes of all elements are shuffled (first bytes, then second bytes, ...)
+# before compressing, which groups the slowly changing sign/exponent bytes of floats together.
+def compress_column(arr, codec, shuffle=True):
+    raw = np.ascontiguousarray(arr)
+    if shuffle and raw.dtype.itemsize > 1:
+        raw = np.ascontiguousarray(raw.view(np.uint8).reshape(-1, raw.dtype.itemsize).T)
+    data = raw.tobytes()
+    if codec == 'zlib':
+        return zlib.compress(data, 1)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'lz4':
+        return lz4.frame.compress(data)
+    raise ValueError("Unknown compression codec: {}".format(codec))
+
+
+def decompress_column(data, dtype, shape, codec, shuffle=True):
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    elif codec == 'zstd':
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == 'lz4':
+        data = lz4.frame.decompress(data)
+    else:
+        raise ValueError("Unknown compression codec: {}".format(codec))
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if shuffle and dtype.itemsize > 1:
+        raw = np.ascontiguousarray(raw.reshape(dtype.itemsize, -1).T)
+    return raw.view(dtype).reshape(shape)
+
+
+# split a memory into its named columns, accepts one of the memory classes or a legacy (s, a, r, s', d) matrix
+def split_columns(memory, state_size, action_size):
+    if hasattr(memory, 'columns'):
+        return memory.columns()
+    return {'states': memory[:, :state_size],
+            'actions': memory[:, state_size:state_size + action_size],
+            'rewards': memory[:, state_size + action_size],
+            'next_states': memory[:, -state_size - 1:-1],
+            'dones': memory[:, -1]}
+
+
+def episode_starts(dones):
+    starts = np.flatnonzero(dones) + 1
+    return np.concatenate(([0], starts[starts < len(dones)])).astype(np.int64)
+
+
+# A transition dataset is a directory of fixed-size column chunks plus index.json.
+# Every shard (one memory, e.g. one round of one corruption rate) carries its own
+# provenance tags so loaders can pick shards without parsing file names.
+# Chunks are plain .npy files or, with compression ('zlib', 'zstd' or 'lz4'), shuffled and
+# compressed column files that are decoded one chunk at a time when read.
+class TransitionDatasetWriter(object):
+    def __init__(self, path, state_size, action_size, chunk_size=100000, compression=None, **provenance):
+        self.path = path
+        self.chunk_size = chunk_size
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            with open(os.path.join(path, INDEX_FILE)) as f:
+                self.index = json.load(f)
+            assert self.index['state_size'] == state_size and self.index['action_size'] == action_size
+            assert self.index.get('compression') == compression
+        else:
+            self.index = {'state_size': state_size,
+                          'action_size': action_size,
+                          'compression': compression,
+                          'columns': {'states': ['float32', state_size],
+                                      'actions': ['float32', action_size],
+                                      'rewards': ['float32', 1],
+                                      'next_states': ['float32', state_size],
+                                      'dones': ['bool', 1]},
+                          'provenance': provenance,
+                          'shards': []}
+
+    def add_shard(self, memory, **tags):
+        columns = split_columns(memory, self.index['state_size'], self.index['action_size'])
+        shard_id = len(self.index['shards'])
+        rows = len(columns['dones'])
+
+        chunks = [self.write_chunk(shard_id, chunk_id, columns, lo, min(lo + self.chunk_size, rows))
+                  for chunk_id, lo in enumerate(range(0, rows, self.chunk_size))]
+
+        episodes_file = '{:05d}_episode_starts.npy'.format(shard_id)
+        starts = episode_starts(columns['dones'])
+        np.save(os.path.join(self.path, episodes_file), starts)
+
+        self.index['shards'].append({'rows': rows,
+                                     'episodes': len(starts),
+                                     'episode_starts': episodes_file,
+                                     'chunks': chunks,
+                                     'tags': tags})
+        self.flush()
+
+    # write rows [lo, hi) of the columns as one chunk of the shard, returns its index entry
+    def write_chunk(self, shard_id, chunk_id, columns, lo, hi):
+        prefix = '{:05d}_{:05d}'.format(shard_id, chunk_id)
+        for name in COLUMNS:
+            dtype = self.index['columns'][name][0]
+            data = np.ascontiguousarray(columns[name][lo:hi], dtype=dtype)
+            if self.index['compression'] is None:
+                np.save(os.path.join(self.path, '{}_{}.npy'.format(prefix, name)), data)
+            else:
+                codec = self.index['compression']
+                with open(os.path.join(self.path, '{}_{}.{}'.format(prefix, name, codec)), 'wb') as f:
+                    f.write(compress_column(data, codec))
+        return {'prefix': prefix, 'rows': hi - lo}
+
+    # a new shard that is filled one transition at a time, see ShardStream
+    def stream(self, **tags):
+        return ShardStream(self, **tags)
+
+    def flush(self):
+        with open(os.path.join(self.path, INDEX_FILE), 'w') as f:
+            json.dump(self.index, f, indent=1)
+
+
+# Collects transitions for one shard in a RAM buffer of chunk_size rows and writes every full
+# buffer out as the shard's next chunk, so collecting any number of steps needs constant memory.
+# index.json is rewritten after each chunk: an interrupted collection loses at most the
+# transitions still in the buffer, everything before is a readable shard.
+class ShardStream(object):
+    def __init__(self, writer, **tags):
+        self.writer = writer
+        self.shard_id = len(writer.index['shards'])
+        self.shard = {'rows': 0,
+                      'episodes': 0,
+                      'episode_starts': '{:05d}_episode_starts.npy'.format(self.shard_id),
+                      'chunks': [],
+                      'tags': tags}
+        self.buffer = TransitionMemory(writer.chunk_size, writer.index['state_size'], writer.index['action_size'])
+        self.episodes = EpisodeIndex()
+
+    def __len__(self):
+        return self.shard['rows'] + len(self.buffer)
+
+    def append(self, state, action, reward, next_state, done):
+        self.buffer.append(state, action, reward, next_state, done)
+        self.episodes.step(done)
+        if len(self.buffer) == self.buffer.capacity:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        if not self.shard['chunks']:
+            self.writer.index['shards'].append(self.shard)
+        chunk = self.writer.write_chunk(self.shard_id, len(self.shard['chunks']), self.buffer.columns(),
+                                        0, len(self.buffer))
+        self.buffer.clear()
+        self.shard['chunks'].append(chunk)
+        self.shard['rows'] += chunk['rows']
+
+        starts = np.asarray(self.episodes.starts, dtype=np.int64)
+        starts = starts[starts < self.episodes.total]
+        np.save(os.path.join(self.writer.path, self.shard['episode_starts']), starts)
+        self.shard['episodes'] = len(starts)
+        self.writer.flush()
+
+    def close(self):
+        self.flush()
+
+
+# rows of a chunk as the legacy (s, a, r, s', d) layout, gathered from the column files on slicing
+class ChunkRows(object):
+    def __init__(self, columns):
+        self.columns = columns
+        self.width = sum(1 if col.ndim == 1 else col.shape[1] for col in columns)
+        self.shape = (len(columns[0]), self.width)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        return np.column_stack([col[item] for col in self.columns])
+
+
+# same for a compressed chunk, decoded by the dataset on first access
+class CompressedChunkRows(ChunkRows):
+    def __init__(self, dataset, chunk):
+        self.dataset = dataset
+        self.chunk = chunk
+        self.shape = (chunk['rows'], 2 * dataset.state_size + dataset.action_size + 2)
+
+    @property
+    def columns(self):
+        return self.dataset.decoded_chunk(self.chunk)
+
+
+class TransitionDataset(object):
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.state_size = self.index['state_size']
+        self.action_size = self.index['action_size']
+        self.provenance = self.index['provenance']
+        self.compression = self.index.get('compression')
+        self._decoded = (None, None)  # last decoded chunk
+
+    # shards whose tags match all given ones, e.g. select(kind='IMPUTED', rate=0.25)
+    def select(self, **tags):
+        return [shard for shard in self.index['shards']
+                if all(shard['tags'].get(key) == value for key, value in tags.items())]
+
+    def load_chunk(self, chunk, name):
+        if self.compression is None:
+            return np.load(os.path.join(self.path, '{}_{}.npy'.format(chunk['prefix'], name)),
+                           mmap_mode=self.mmap_mode)
+        dtype, width = self.index['columns'][name]
+        shape = (chunk['rows'],) if name in VECTOR_COLUMNS else (chunk['rows'], width)
+        with open(os.path.join(self.path, '{}_{}.{}'.format(chunk['prefix'], name, self.compression)), 'rb') as f:
+            return decompress_column(f.read(), dtype, shape, self.compression)
+
+    # all columns of a chunk, keeping only the most recently used chunk decoded
+    def decoded_chunk(self, chunk):
+        if self._decoded[0] != chunk['prefix']:
+            self._decoded = (chunk['prefix'], [self.load_chunk(chunk, name) for name in COLUMNS])
+        return self._decoded[1]
+
+    # decode the selected shards chunk by chunk, yielding {column name: array}
+    def iter_chunks(self, names=COLUMNS, **tags):
+        for shard in self.select(**tags):
+            for chunk in shard['chunks']:
+                yield dict((name, self.load_chunk(chunk, name)) for name in names)
+
+    # one column over all selected shards, only that column's files are touched
+    def column(self, name, **tags):
+        parts = [self.load_chunk(chunk, name) for shard in self.select(**tags) for chunk in shard['chunks']]
+        return np.concatenate(parts) if parts else np.empty((0,), dtype=self.index['columns'][name][0])
+
+    def columns(self, names, **tags):
+        return dict((name, self.column(name, **tags)) for name in names)
+
+    # episode start rows over all selected shards, in the concatenated row numbering
+    def episode_starts(self, **tags):
+        starts, offset = [], 0
+        for shard in self.select(**tags):
+            starts.append(np.load(os.path.join(self.path, shard['episode_starts'])) + offset)
+            offset += shard['rows']
+        return np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+
+    def transition_batch(self, **tags):
+        cols = self.columns(('states', 'actions', 'next_states'), **tags)
+        return np.hstack((cols['states'], cols['actions'])), cols['next_states'] - cols['states']
+
+    # memory-mapped (or chunk-decoding) store over the selected shards, for streaming training
+    def store(self, **tags):
+        if self.compression is None:
+            shards = [ChunkRows([self.load_chunk(chunk, name) for name in COLUMNS])
+                      for shard in self.select(**tags) for chunk in shard['chunks']]
+        else:
+            shards = [CompressedChunkRows(self, chunk) for shard in self.select(**tags) for chunk in shard['chunks']]
+        return MmapTransitionStore(shards, self.state_size, self.action_size)
+
+    # missingness mask over the selected shards, for store(...).set_missing_mask or MissingMask.apply
+    def missing_mask(self, rate, seed=0, **tags):
+        return MissingMask(self.column('dones', **tags), self.state_size, rate, seed=seed)
+
+    # selected shards loaded into an in-RAM TransitionMemory
+    def memory(self, **tags):
+        cols = self.columns(COLUMNS, **tags)
+        mem = TransitionMemory(len(cols['dones']), self.state_size, self.action_size)
+        mem.states[:] = cols['states']
+        mem.actions[:] = cols['actions']
+        mem.rewards[:] = cols['rewards']
+        mem.next_states[:] = cols['next_states']
+        mem.dones[:] = cols['dones']
+        mem.size = len(cols['dones'])
+        mem.episodes.extend(mem.dones)
+        return mem
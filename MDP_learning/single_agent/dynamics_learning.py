@@ -1,4 +1,3 @@
-from collections import deque
 from keras.callbacks import TensorBoard
 import gym
 import numpy as np
@@ -8,10 +7,19 @@ from fancyimpute import KNN, SimpleFill, SoftImpute, MICE, IterativeSVD, Nuclear
 from MDP_learning.single_agent.preprocessing import standardise_memory, make_mem_partial_obs, setup_batch_for_RNN, \
     impute_missing
 from MDP_learning.single_agent.networks import build_regression_model, build_recurrent_regression_model, build_dmodel
+from MDP_learning.single_agent.memory import TransitionMemory, EpisodeMemory, CompactTransitionMemory, \
+    ReservoirTransitionMemory
+from MDP_learning.single_agent.transition_store import MmapTransitionStore
+from MDP_learning.single_agent.dataset import TransitionDataset
+from MDP_learning.single_agent.parallel_collect import collect_parallel, collect_episodes
+from MDP_learning.single_agent.pipeline import BackgroundCollector
 from time import time
 import random
 
 from MDP_learning.helpers.logging_model_learner import LoggingModelLearner
+from MDP_learning.helpers.prioritized_replay import fit_prioritized
+from MDP_learning.helpers.vec_env import VecEnv
+from MDP_learning.helpers.window_sequence import WindowSequence, fit_windows
 
 
 # A neural network dynamics model learner under partial observability
@@ -19,7 +27,8 @@ from MDP_learning.helpers.logging_model_learner import LoggingModelLearner
 class ModelLearner(LoggingModelLearner):
     def __init__(self, env_name, observation_space, action_space, data_size=200000, epochs=100, learning_rate=.001,
                  tmodel_dim_multipliers=[1,1], tmodel_activations=('relu', 'relu'), sequence_length=0,
-                 partial_obs_rate=0.0):
+                 partial_obs_rate=0.0, episode_storage=False, compact_storage=False, state_dtype=np.float32,
+                 prioritized=False, continual=None, round_size=None, n_envs=1, n_workers=1, collect_seed=None):
         from collections import namedtuple
         Spec = namedtuple('Spec', 'id')
         Myenv = namedtuple('Myenv', ['spec'])
@@ -41,10 +50,44 @@ class ModelLearner(LoggingModelLearner):
         self.learning_rate = learning_rate
         self.net_train_epochs = epochs
         self.partial_obs_rate = partial_obs_rate
+        # sample tmodel minibatches in proportion to its per-transition error
+        self.prioritized = prioritized
 
-        # create replay memory using deque
+        # create replay memory as a preallocated ring buffer
+        # or, with episode_storage, keeping each observation once instead of as s and s'
+        # or, with compact_storage, in reduced precision (state_dtype) upcast per minibatch
+        # or, with continual='reservoir'/'recency', kept across rounds as a bounded sample of all steps
         self.data_size = data_size
-        self.memory = deque(maxlen=self.data_size)
+        self.continual = continual
+        self.round_size = data_size if round_size is None else round_size  # new steps collected per round
+        bounded = np.all(np.isfinite(observation_space.low)) and np.all(np.isfinite(observation_space.high))
+        if continual:
+            self.memory = ReservoirTransitionMemory(self.data_size, self.state_size, self.action_size, mode=continual)
+        elif episode_storage:
+            self.memory = EpisodeMemory(self.data_size, self.state_size, self.action_size)
+        elif compact_storage:
+            self.memory = CompactTransitionMemory(self.data_size, self.state_size, self.action_size,
+                                                  state_dtype=state_dtype,
+                                                  action_num=self.action_num,
+                                                  state_offset=observation_space.low if bounded else 0.,
+                                                  state_scale=observation_space.high - observation_space.low
+                                                  if bounded else 1.)
+        else:
+            self.memory = TransitionMemory(self.data_size, self.state_size, self.action_size)
+        # unbounded spaces (e.g. MuJoCo's Box(-inf, inf)) give no scaling for the compact codes,
+        # it is fitted to a warm-up rollout before the first collection instead
+        self.scaling_warmup = min(10000, self.data_size) if compact_storage and not continual \
+            and not episode_storage and not bounded else 0
+        # with n_envs > 1 refill_mem steps that many copies of the environment in lockstep,
+        # with n_workers > 1 it collects with that many processes, each with its own environment;
+        # with collect_seed it collects whole episodes seeded from (collect_seed, episode index),
+        # which gives the same data for any n_workers
+        self.n_envs = n_envs
+        self.n_workers = n_workers
+        self.collect_seed = collect_seed
+        self.episodes_collected = 0
+        if (max(n_envs, n_workers) > 1 or collect_seed is not None) and (episode_storage or continual):
+            raise ValueError("Parallel and seeded collection need a TransitionMemory or CompactTransitionMemory")
 
         # tmodel_dim_multipliers was used to increase the number of units
         # per layer as a function of the state size in the environment
@@ -55,7 +98,9 @@ class ModelLearner(LoggingModelLearner):
                                                            lr=learning_rate,
                                                            dim_multipliers=tmodel_dim_multipliers,
                                                            activations=tmodel_activations)
-            self.seq_mem = deque(maxlen=self.sequence_length)
+            # rolling (1, seq_len, s + a) input window used by step
+            self.seq_mem = np.zeros((1, self.sequence_length, self.state_size + self.action_size), dtype=np.float32)
+            self.seq_mem_filled = 0
         else:
             self.tmodel = build_regression_model(self.state_size + self.action_size, self.state_size,
                                                  lr=learning_rate,
@@ -79,29 +124,82 @@ class ModelLearner(LoggingModelLearner):
     def get_action(self, state, environment):
         return environment.action_space.sample()
 
+    # actions for a [K, state_size] slab of states of a VecEnv
+    def get_actions(self, states, environments):
+        return np.array([self.get_action(state, env) for state, env in zip(states, environments.envs)])
+
+    # fit the compact memory's state scaling to scaling_warmup random steps
+    def warm_up_scaling(self, environment):
+        environment = environment.envs[0] if isinstance(environment, VecEnv) else environment
+        states = []
+        state = environment.reset()
+        for i in range(self.scaling_warmup):
+            next_state, reward, done, info = environment.step(self.get_action(state, environment))
+            states.append(state)
+            states.append(next_state)
+            state = environment.reset() if done else next_state
+        self.memory.clear()
+        self.memory.fit_scaling(states)
+        self.scaling_warmup = 0
+
     # filling up memory of transitions
     def refill_mem(self, environment):
+        if self.scaling_warmup:
+            self.warm_up_scaling(environment)
+        if self.n_envs > 1:
+            self.refill_mem_vectorized(environment)
+            return
+        if self.collect_seed is not None:
+            _, n_episodes = collect_episodes(environment.spec.id, self.data_size, self.n_workers, self.state_size,
+                                             self.action_size, base_seed=self.collect_seed,
+                                             first_episode=self.episodes_collected, memory=self.memory)
+            self.episodes_collected += n_episodes
+            return
+        if self.n_workers > 1:
+            collect_parallel(environment.spec.id, self.data_size, self.n_workers, self.state_size, self.action_size,
+                             seed=np.random.randint(2 ** 31 - self.n_workers), memory=self.memory)
+            return
         state = environment.reset()
-        self.memory.clear()
-        for i in range(self.data_size):
+        if self.continual:
+            self.memory.break_sequence()
+        else:
+            self.memory.clear()
+        for i in range(self.round_size):
             action = self.get_action(state, environment)
             next_state, reward, done, info = environment.step(action)
-            self.memory.append(np.hstack((state, action, reward, next_state, done * 1)))
+            self.memory.append(state, action, reward, next_state, done)
             if done:
                 state = environment.reset()
             else:
                 state = next_state
 
+    # same with n_envs environment copies stepped in lockstep, one [n_envs, ...] slab per tick;
+    # each copy fills its own contiguous block of rows, so sequence windows never mix copies
+    def refill_mem_vectorized(self, environment):
+        envs = environment if isinstance(environment, VecEnv) else VecEnv.copies(environment, self.n_envs)
+        # the first data_size % n_envs environments keep one extra step, so exactly data_size steps are stored
+        lengths = np.full(envs.n_envs, self.data_size // envs.n_envs)
+        lengths[:self.data_size % envs.n_envs] += 1
+        rows = np.cumsum(lengths) - lengths
+        self.memory.clear()
+        states = envs.reset()
+        for t in range(lengths[0]):
+            actions = np.asarray(self.get_actions(states, envs))
+            next_states, rewards, dones = envs.step(actions)
+            keep = lengths > t
+            self.memory.put(rows[keep] + t, states[keep], actions[keep], rewards[keep], next_states[keep], dones[keep])
+            states = envs.states
+        self.memory.commit(lengths)
+
     # defines the training process
     def train_models(self, minibatch_size=32, steps_per_epoch=None):
 
-        memory_arr = np.array(self.memory)
-        
         '''
         put this code back if you want to corrupt
         the agent's memory, and then run an imputation
         on the corrupted memory
         
+        memory_arr = np.array(self.memory)
         if self.partial_obs_rate > 0:
             # creating missing state feature values
             make_mem_partial_obs(memory_arr, self.state_size, self.partial_obs_rate)
@@ -115,14 +213,35 @@ class ModelLearner(LoggingModelLearner):
         
         #normalizing the data values to [0,1]
         # already done outside standardise_memory(memory_arr, self.state_size, self.action_size)
-        batch_size = len(memory_arr)
+        batch_size = len(self.memory)
         minibatch_size = None if minibatch_size is None else min(minibatch_size, batch_size)
 
+        if isinstance(self.memory, (MmapTransitionStore, CompactTransitionMemory)) and not self.useRNN:
+            self.train_models_streaming(32 if minibatch_size is None else minibatch_size, steps_per_epoch)
+            return
+
+        if self.useRNN and not self.prioritized:
+            fit_windows(self.tmodel, self.rnn_windows(32 if minibatch_size is None else minibatch_size),
+                        epochs=self.net_train_epochs,
+                        steps_per_epoch=steps_per_epoch,
+                        validation_split=0.1,
+                        callbacks=self.Ttensorboard)
+            return
+
         if self.useRNN:
-            t_x, t_y = setup_batch_for_RNN(memory_arr, self.sequence_length, self.state_size, self.action_size)
+            # windows come from the episode boundaries the memory keeps while it is filled
+            t_x, t_y = self.memory.sequence_batch(self.sequence_length)
         else:
-            t_x = memory_arr[:, :self.state_size + self.action_size]
-            t_y = memory_arr[:, -self.state_size - 1:-1] - memory_arr[:, :self.state_size]
+            t_x, t_y = self.memory.transition_batch()
+
+        if self.prioritized:
+            fit_prioritized(self.tmodel, t_x, t_y,
+                            minibatch_size=32 if minibatch_size is None else minibatch_size,
+                            epochs=self.net_train_epochs,
+                            steps_per_epoch=steps_per_epoch,
+                            validation_split=0.1,
+                            callbacks=self.Ttensorboard)
+            return
 
         self.tmodel.fit(t_x, t_y,
                         batch_size=minibatch_size,
@@ -147,6 +266,26 @@ class ModelLearner(LoggingModelLearner):
                         validation_split=0.1,
                         callbacks=self.Dtensorboard, verbose=0)
         '''
+    # RNN windows gathered from the memory one minibatch at a time, so training memory does not grow
+    # with the sequence length; a memory-mapped store only reads the rows of each minibatch's windows
+    def rnn_windows(self, minibatch_size):
+        # windows come from the episode boundaries the memory keeps while it is filled
+        return WindowSequence(lambda starts: self.memory.window_batch(starts, self.sequence_length),
+                              self.memory.valid_starts(self.sequence_length), minibatch_size)
+
+    # fit on minibatches read one at a time from a memory-mapped store or a compact memory,
+    # keeping the last 10% for validation
+    def train_models_streaming(self, minibatch_size, steps_per_epoch=None):
+        split = int(len(self.memory) * 0.9)
+        self.tmodel.fit_generator(self.memory.generator(minibatch_size, 0, split),
+                                  steps_per_epoch=steps_per_epoch or self.memory.steps_per_epoch(minibatch_size,
+                                                                                                 0, split),
+                                  epochs=self.net_train_epochs,
+                                  validation_data=self.memory.generator(minibatch_size, split, shuffle=False),
+                                  validation_steps=self.memory.steps_per_epoch(minibatch_size, split),
+                                  callbacks=self.Ttensorboard,
+                                  verbose=1)
+
     #This function can be used to create new simulated experiences using the
     #trained dynamics, reward and terminal models
      
@@ -156,10 +295,12 @@ class ModelLearner(LoggingModelLearner):
         action = np.reshape(action, [1, self.action_size])
 
         if self.useRNN:
-            self.seq_mem.append(np.hstack((state, action)))
-            if len(self.seq_mem) is self.sequence_length:
-                seq = np.array(self.seq_mem)
-                next_state = self.tmodel.predict(np.rollaxis(seq, 1), batch_size)
+            self.seq_mem[0, :-1] = self.seq_mem[0, 1:]
+            self.seq_mem[0, -1, :self.state_size] = state
+            self.seq_mem[0, -1, self.state_size:] = action
+            self.seq_mem_filled = min(self.seq_mem_filled + 1, self.sequence_length)
+            if self.seq_mem_filled == self.sequence_length:
+                next_state = self.tmodel.predict(self.seq_mem, batch_size)
             else:
                 next_state = state
         else:
@@ -176,6 +317,42 @@ class ModelLearner(LoggingModelLearner):
             self.refill_mem(environment)
             self.train_models()
 
+    # same with collection and training overlapped: a background thread keeps stepping the environment
+    # and each minibatch is drawn from the memory after appending the blocks finished so far.
+    # max_staleness blocks of block_size steps bound how far the producer may run ahead of training.
+    def run_pipelined(self, environment, rounds=1, minibatch_size=32, block_size=1000, max_staleness=4):
+        if isinstance(self.memory, EpisodeMemory):
+            raise ValueError("Pipelined collection needs a memory with random_batch, not an EpisodeMemory")
+        producer = BackgroundCollector(environment, self.get_action, self.state_size, self.action_size,
+                                       block_size=block_size, max_staleness=max_staleness)
+        if self.scaling_warmup:
+            self.warm_up_scaling(environment)
+        self.memory.clear()
+        producer.start()
+        try:
+            for e in range(rounds):
+                self.tmodel.fit_generator(self.pipelined_batches(producer, minibatch_size),
+                                          steps_per_epoch=self.data_size // minibatch_size,
+                                          epochs=self.net_train_epochs,
+                                          callbacks=self.Ttensorboard,
+                                          verbose=1)
+        finally:
+            producer.stop()
+
+    def pipelined_batches(self, producer, minibatch_size):
+        sequence_length = self.sequence_length if self.useRNN else 0
+        while True:
+            producer.drain(self.memory)
+            while not self.batch_ready(minibatch_size, sequence_length):
+                producer.drain(self.memory, wait=True)
+            yield self.memory.random_batch(minibatch_size, sequence_length)
+
+    # the memory holds a window of sequence_length steps, or minibatch_size rows without sequences
+    def batch_ready(self, minibatch_size, sequence_length):
+        if sequence_length:
+            return len(self.memory.valid_starts(sequence_length)) > 0
+        return len(self.memory) >= minibatch_size
+
 
 if __name__ == "__main__":
     # ['Ant-v1', 'LunarLander-v2', 'BipedalWalker-v2', FrozenLake8x8-v0, 'MountainCar-v0', 'Acrobot-v1', 'CartPole-v1']:"Pong-ram-v4"
@@ -202,15 +379,11 @@ if __name__ == "__main__":
         with open('{}_action_space.pickle'.format(env_name), 'rb') as f:
             action_space = pickle.load(f)
         ML = ModelLearner(env_name, observation_space, action_space, partial_obs_rate=0.25, sequence_length=0)
-        mem0 = np.load('../save_memory1/{}IMPUTED0.25round0.npy'.format(env_name))
-        mem1 = np.load('../save_memory1/{}IMPUTED0.25round1.npy'.format(env_name))
-        mem2 = np.load('../save_memory1/{}IMPUTED0.25round2.npy'.format(env_name))
-        mem3 = np.load('../save_memory1/{}IMPUTED0.25round3.npy'.format(env_name))
-        mem4 = np.load('../save_memory1/{}IMPUTED0.25round4.npy'.format(env_name))
-        mem = np.vstack((mem0,mem1,mem2,mem3,mem4))
+        # the five imputed rounds are memory-mapped and streamed instead of vstacked in RAM
+        mem = TransitionDataset('../save_memory1/{}'.format(env_name)).store(kind='IMPUTED', rate=0.25)
 
-        print(mem.shape)
+        print((len(mem), mem.shards[0].shape[1]))
 
-        standardise_memory(mem, ML.state_size, ML.action_size)
+        mem.set_minmax_scaling()
         ML.memory = mem
         ML.train_models()
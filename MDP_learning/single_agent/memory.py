@@ -0,0 +1,445 @@
+import numpy as np
+
+from MDP_learning.helpers.episode_index import EpisodeIndex
+
+
+# Fixed-capacity ring buffer of transitions <s, a, r, s', d>.
+# Every column is preallocated once; states and actions share one block so that
+# the network input (state, action) is a plain view and never has to be stacked.
+class TransitionMemory(object):
+    def __init__(self, capacity, state_size, action_size, dtype=np.float32):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.action_size = action_size
+
+        self.inputs = np.zeros((capacity, state_size + action_size), dtype=dtype)
+        self.states = self.inputs[:, :state_size]
+        self.actions = self.inputs[:, state_size:]
+        self.rewards = np.zeros(capacity, dtype=dtype)
+        self.next_states = np.zeros((capacity, state_size), dtype=dtype)
+        self.dones = np.zeros(capacity, dtype=np.bool_)
+
+        self.top = 0  # next row to write
+        self.size = 0
+        self.episodes = EpisodeIndex()
+
+    def __len__(self):
+        return self.size
+
+    # lets np.array(memory) keep producing the old (s, a, r, s', d) matrix
+    def __array__(self, dtype=None, copy=None):
+        arr = self.as_array()
+        return arr if dtype is None else arr.astype(dtype)
+
+    def append(self, state, action, reward, next_state, done):
+        ii = self.top
+        self.states[ii] = state
+        self.actions[ii] = action
+        self.rewards[ii] = reward
+        self.next_states[ii] = next_state
+        self.dones[ii] = done
+        self.top = (ii + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.episodes.step(done)
+
+    def clear(self):
+        self.top = 0
+        self.size = 0
+        self.episodes.clear()
+
+    # write one [n, ...] slab to the buffer rows `rows`, e.g. one tick of n lockstep environments;
+    # size and episode bookkeeping are left to commit()
+    def put(self, rows, states, actions, rewards, next_states, dones):
+        self.states[rows] = states
+        self.actions[rows] = np.reshape(actions, (len(rows), -1))
+        self.rewards[rows] = rewards
+        self.next_states[rows] = next_states
+        self.dones[rows] = dones
+
+    # append a whole [n, ...] slab of consecutive steps, wrapping around like append
+    def extend(self, states, actions, rewards, next_states, dones):
+        n = len(dones)
+        self.put((self.top + np.arange(n)) % self.capacity, states, actions, rewards, next_states, dones)
+        self.top = (self.top + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        self.episodes.extend(dones)
+
+    # the first rows of a cleared memory were filled with put() as consecutive streams of the given
+    # lengths (one per environment or worker); episodes end at terminals and at the end of every stream
+    def commit(self, stream_lengths):
+        n = int(np.sum(stream_lengths))
+        self.top = n % self.capacity
+        self.size = n
+        self.episodes.clear()
+        dones = self.dones
+        for lo, hi in zip(np.cumsum(stream_lengths) - stream_lengths, np.cumsum(stream_lengths)):
+            self.episodes.extend(dones[lo:hi])
+            self.episodes.split()
+
+    # rows in the order they were written, oldest first
+    # this is a view unless the buffer has wrapped around with a partial last lap
+    def ordered(self, column):
+        if self.size < self.capacity or self.top == 0:
+            return column[:self.size]
+        return np.concatenate((column[self.top:], column[:self.top]))
+
+    # buffer rows of ordered() positions
+    def physical(self, idx):
+        return (np.asarray(idx) + self.top - self.size) % self.capacity
+
+    # random minibatch (x, y) read straight from the buffer rows: (s, a) and s' - s,
+    # or with sequence_length windows of (s, a) and the next state after each window
+    def random_batch(self, minibatch_size, sequence_length=0):
+        if sequence_length:
+            return self.window_batch(np.random.choice(self.valid_starts(sequence_length), minibatch_size),
+                                     sequence_length)
+        rows = self.physical(np.random.randint(self.size, size=minibatch_size))
+        return self.inputs[rows], self.next_states[rows] - self.states[rows]
+
+    # network input (s, a) and target s' - s for the transition model
+    def transition_batch(self):
+        x = self.ordered(self.inputs)
+        y = self.ordered(self.next_states) - self.ordered(self.states)
+        return x, y
+
+    # first rows (in ordered() numbering) of all sequence_length windows without an intermediate terminal
+    def valid_starts(self, sequence_length):
+        return self.episodes.valid_starts(sequence_length, self.episodes.total - self.size)
+
+    # RNN input windows of (s, a) starting at the given ordered() positions and the next state
+    # after each window's last step, read straight from the buffer rows
+    def window_batch(self, starts, sequence_length):
+        windows = self.physical(np.asarray(starts)[:, np.newaxis] + np.arange(sequence_length))
+        return self.inputs[windows], self.next_states[windows[:, -1]]
+
+    # all valid windows at once
+    def sequence_batch(self, sequence_length):
+        return self.window_batch(self.valid_starts(sequence_length), sequence_length)
+
+    def columns(self):
+        return {'states': self.ordered(self.states),
+                'actions': self.ordered(self.actions),
+                'rewards': self.ordered(self.rewards),
+                'next_states': self.ordered(self.next_states),
+                'dones': self.ordered(self.dones)}
+
+    def as_array(self):
+        return np.hstack((self.ordered(self.inputs),
+                          self.ordered(self.rewards)[:, np.newaxis],
+                          self.ordered(self.next_states),
+                          self.ordered(self.dones)[:, np.newaxis]))
+
+    # wrap a legacy (s, a, r, s', d) matrix, e.g. one of the saved .npy memories
+    @classmethod
+    def from_array(cls, memory, state_size, action_size, dtype=np.float32):
+        mem = cls(len(memory), state_size, action_size, dtype=dtype)
+        mem.inputs[:] = memory[:, :state_size + action_size]
+        mem.rewards[:] = memory[:, state_size + action_size]
+        mem.next_states[:] = memory[:, -state_size - 1:-1]
+        mem.dones[:] = memory[:, -1]
+        mem.size = len(memory)
+        mem.episodes.extend(mem.dones)
+        return mem
+
+
+# Bounded memory for continual collection over many rounds: it is never cleared between rounds
+# and keeps a representative sample of everything appended so far. With mode='reservoir' every
+# step seen has the same chance to be kept, with mode='recency' a full memory overwrites a random
+# row, so older steps survive with geometrically decaying probability.
+# Rows are in no particular order; each carries its step id, and ordered() sorts by it.
+# Windows for RNNs only span rows with consecutive ids, so dropped steps break them like terminals.
+class ReservoirTransitionMemory(TransitionMemory):
+    def __init__(self, capacity, state_size, action_size, dtype=np.float32, mode='reservoir'):
+        super().__init__(capacity, state_size, action_size, dtype=dtype)
+        if mode not in ('reservoir', 'recency'):
+            raise ValueError("Unknown continual memory mode: {}".format(mode))
+        self.mode = mode
+        self.step_ids = np.zeros(capacity, dtype=np.int64)
+        self.seen = 0  # steps appended since the last clear()
+        self.next_id = 0
+        self._order = None  # (sort order, EpisodeIndex of the sorted rows), rebuilt after writes
+
+    def append(self, state, action, reward, next_state, done):
+        if self.size < self.capacity:
+            ii = self.size
+            self.size += 1
+        elif self.mode == 'reservoir':
+            ii = np.random.randint(self.seen + 1)
+        else:
+            ii = np.random.randint(self.capacity)
+        self.seen += 1
+        if ii < self.capacity:
+            self.states[ii] = state
+            self.actions[ii] = action
+            self.rewards[ii] = reward
+            self.next_states[ii] = next_state
+            self.dones[ii] = done
+            self.step_ids[ii] = self.next_id
+            self._order = None
+        self.next_id += 1
+
+    # a slab of consecutive steps goes through the reservoir/recency rule one step at a time
+    def extend(self, states, actions, rewards, next_states, dones):
+        for step in zip(states, actions, rewards, next_states, dones):
+            self.append(*step)
+
+    # the next step does not continue the last one, e.g. the environment was reset for a new round
+    def break_sequence(self):
+        self.next_id += 1
+
+    def clear(self):
+        super().clear()
+        self.seen = 0
+        self.next_id = 0
+        self._order = None
+
+    def order(self):
+        if self._order is None:
+            order = np.argsort(self.step_ids[:self.size], kind='stable')
+            ids = self.step_ids[order]
+            breaks = self.dones[order]
+            breaks[:-1] |= ids[1:] != ids[:-1] + 1
+            index = EpisodeIndex()
+            index.extend(breaks)
+            self._order = (order, index)
+        return self._order[0]
+
+    def ordered(self, column):
+        return column[self.order()]
+
+    def physical(self, idx):
+        return self.order()[idx]
+
+    def valid_starts(self, sequence_length):
+        self.order()
+        return self._order[1].valid_starts(sequence_length)
+
+
+# Reduced-precision TransitionMemory: states stored as state_dtype (e.g. float16) after a
+# per-column offset/scale, discrete actions as the smallest fitting unsigned int and done
+# flags bit-packed. Columns are only upcast to float32 for the rows that are read,
+# e.g. one minibatch at a time through generator().
+class CompactTransitionMemory(TransitionMemory):
+    def __init__(self, capacity, state_size, action_size, state_dtype=np.float32, action_num=0,
+                 state_offset=0., state_scale=1.):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.action_size = action_size
+
+        self.state_offset = np.zeros(state_size, dtype=np.float32) + state_offset
+        self.state_scale = np.ones(state_size, dtype=np.float32) * state_scale
+        self.state_scale[self.state_scale == 0] = 1.
+        action_dtype = np.min_scalar_type(action_num - 1) if action_num > 0 else state_dtype
+        self.state_codes = np.zeros((capacity, state_size), dtype=state_dtype)
+        self.next_state_codes = np.zeros((capacity, state_size), dtype=state_dtype)
+        self.action_codes = np.zeros((capacity, action_size), dtype=action_dtype)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.done_bits = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+
+        self.top = 0
+        self.size = 0
+        self.episodes = EpisodeIndex()
+
+    # fit the per-column offset/scale to a sample of states, e.g. from a warm-up rollout when the
+    # observation space is unbounded; the memory has to be empty, stored codes would no longer decode
+    def fit_scaling(self, states):
+        if self.size:
+            raise ValueError("Scaling can only be fitted to an empty CompactTransitionMemory")
+        states = np.asarray(states, dtype=np.float32)
+        self.state_offset = states.min(axis=0)
+        self.state_scale = states.max(axis=0) - self.state_offset
+        self.state_scale[self.state_scale == 0] = 1.
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in (self.state_codes, self.next_state_codes, self.action_codes,
+                                         self.rewards, self.done_bits))
+
+    def append(self, state, action, reward, next_state, done):
+        ii = self.top
+        self.state_codes[ii] = (state - self.state_offset) / self.state_scale
+        self.next_state_codes[ii] = (next_state - self.state_offset) / self.state_scale
+        self.action_codes[ii] = action
+        self.rewards[ii] = reward
+        if done:
+            self.done_bits[ii >> 3] |= 0x80 >> (ii & 7)
+        else:
+            self.done_bits[ii >> 3] &= ~(0x80 >> (ii & 7)) & 0xFF
+        self.top = (ii + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.episodes.step(done)
+
+    def put(self, rows, states, actions, rewards, next_states, dones):
+        self.state_codes[rows] = (states - self.state_offset) / self.state_scale
+        self.next_state_codes[rows] = (next_states - self.state_offset) / self.state_scale
+        self.action_codes[rows] = np.reshape(actions, (len(rows), -1))
+        self.rewards[rows] = rewards
+        rows = np.asarray(rows)
+        bits = (0x80 >> (rows & 7)).astype(np.uint8)
+        np.bitwise_and.at(self.done_bits, rows >> 3, ~bits)
+        np.bitwise_or.at(self.done_bits, rows[dones] >> 3, bits[dones])
+
+    def decode_states(self, codes):
+        return codes.astype(np.float32) * self.state_scale + self.state_offset
+
+    @property
+    def states(self):
+        return self.decode_states(self.state_codes)
+
+    @property
+    def next_states(self):
+        return self.decode_states(self.next_state_codes)
+
+    @property
+    def actions(self):
+        return self.action_codes.astype(np.float32)
+
+    @property
+    def dones(self):
+        return np.unpackbits(self.done_bits)[:self.capacity].astype(np.bool_)
+
+    @property
+    def inputs(self):
+        return np.hstack((self.states, self.actions))
+
+    # float32 network input (s, a) and target s' - s for the given ordered() positions
+    def batch(self, idx):
+        rows = self.physical(idx)
+        states = self.decode_states(self.state_codes[rows])
+        x = np.concatenate((states, self.action_codes[rows].astype(np.float32)), axis=-1)
+        return x, self.decode_states(self.next_state_codes[rows]) - states
+
+    def transition_batch(self):
+        return self.batch(np.arange(self.size))
+
+    def random_batch(self, minibatch_size, sequence_length=0):
+        if sequence_length:
+            return self.window_batch(np.random.choice(self.valid_starts(sequence_length), minibatch_size),
+                                     sequence_length)
+        return self.batch(np.random.randint(self.size, size=minibatch_size))
+
+    def window_batch(self, starts, sequence_length):
+        starts = np.asarray(starts)
+        x, _ = self.batch(starts[:, np.newaxis] + np.arange(sequence_length))
+        return x, self.decode_states(self.next_state_codes[self.physical(starts + sequence_length - 1)])
+
+    # endless keras generator of float32 (x, y) minibatches over ordered() positions [start, stop)
+    def generator(self, minibatch_size, start=0, stop=None, shuffle=True):
+        stop = self.size if stop is None else stop
+        while True:
+            order = np.random.permutation(np.arange(start, stop)) if shuffle else np.arange(start, stop)
+            for jj in range(0, len(order), minibatch_size):
+                yield self.batch(order[jj:jj + minibatch_size])
+
+    def steps_per_epoch(self, minibatch_size, start=0, stop=None):
+        stop = self.size if stop is None else stop
+        return -(-(stop - start) // minibatch_size)
+
+
+# Episode-structured memory storing every observation once: a step's next state is the
+# following row of `observations`, and each episode adds one terminal observation row.
+# Assumes the state of a step equals the next state of the previous step of the same
+# episode, as collected by refill_mem. Fills up to capacity steps, nothing is overwritten.
+# The state of step i is row i + (ordinal of its episode), so no per-step row index is stored;
+# the observation block holds capacity rows plus one per episode and grows only in that part.
+class EpisodeMemory(object):
+    def __init__(self, capacity, state_size, action_size, dtype=np.float32, max_episodes=None):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.action_size = action_size
+
+        obs_rows = capacity + (max_episodes if max_episodes is not None else capacity // 100 + 1)
+        self.observations = np.zeros((obs_rows, state_size), dtype=dtype)
+        self.actions = np.zeros((capacity, action_size), dtype=dtype)
+        self.rewards = np.zeros(capacity, dtype=dtype)
+        self.dones = np.zeros(capacity, dtype=np.bool_)
+
+        self.size = 0
+        self.obs_top = 0
+        self.episode_open = False
+        self.episodes = EpisodeIndex()
+
+    def __len__(self):
+        return self.size
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.as_array()
+        return arr if dtype is None else arr.astype(dtype)
+
+    def append(self, state, action, reward, next_state, done):
+        if self.size == self.capacity:
+            raise ValueError("EpisodeMemory is full ({} steps)".format(self.capacity))
+        if self.obs_top + 2 > len(self.observations):
+            # more episodes than expected, double the rows kept for episode ends (at most one per step)
+            episode_rows = max(2 * (len(self.observations) - self.capacity), 1)
+            obs_rows = max(min(self.capacity + episode_rows, 2 * self.capacity), self.obs_top + 2)
+            grown = np.zeros((obs_rows, self.state_size), dtype=self.observations.dtype)
+            grown[:self.obs_top] = self.observations[:self.obs_top]
+            self.observations = grown
+        if not self.episode_open:
+            self.observations[self.obs_top] = state
+            self.obs_top += 1
+        ii = self.size
+        self.observations[self.obs_top] = next_state
+        self.obs_top += 1
+        self.actions[ii] = action
+        self.rewards[ii] = reward
+        self.dones[ii] = done
+        self.size += 1
+        self.episode_open = not done
+        self.episodes.step(done)
+
+    def clear(self):
+        self.size = 0
+        self.obs_top = 0
+        self.episode_open = False
+        self.episodes.clear()
+
+    def ordered(self, column):
+        return column[:self.size]
+
+    # observation rows of the states of steps: the step index plus the ordinal of its episode
+    def state_rows(self, steps):
+        return steps + np.searchsorted(np.asarray(self.episodes.starts), steps, side='right') - 1
+
+    # (s, a, r, s', d) columns are materialized on access only
+    @property
+    def states(self):
+        return self.observations[self.state_rows(np.arange(self.size))]
+
+    @property
+    def next_states(self):
+        return self.observations[self.state_rows(np.arange(self.size)) + 1]
+
+    def transition_batch(self):
+        rows = self.state_rows(np.arange(self.size))
+        x = np.hstack((self.observations[rows], self.actions[:self.size]))
+        y = self.observations[rows + 1] - self.observations[rows]
+        return x, y
+
+    def valid_starts(self, sequence_length):
+        return self.episodes.valid_starts(sequence_length)
+
+    def window_batch(self, starts, sequence_length):
+        starts = np.asarray(starts)
+        windows = starts[:, np.newaxis] + np.arange(sequence_length)
+        rows = self.state_rows(windows)
+        x = np.concatenate((self.observations[rows], self.actions[windows]), axis=-1)
+        return x, self.observations[rows[:, -1] + 1]
+
+    def sequence_batch(self, sequence_length):
+        return self.window_batch(self.valid_starts(sequence_length), sequence_length)
+
+    def columns(self):
+        return {'states': self.states,
+                'actions': self.actions[:self.size],
+                'rewards': self.rewards[:self.size],
+                'next_states': self.next_states,
+                'dones': self.dones[:self.size]}
+
+    def as_array(self):
+        return np.hstack((self.states,
+                          self.actions[:self.size],
+                          self.rewards[:self.size, np.newaxis],
+                          self.next_states,
+                          self.dones[:self.size, np.newaxis]))
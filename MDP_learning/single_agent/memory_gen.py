@@ -1,43 +1,59 @@
+import argparse
 import gym
 import numpy as np
-from MDP_learning.single_agent.preprocessing import make_mem_partial_obs, impute_missing, standardise_memory
+from MDP_learning.single_agent.preprocessing import impute_missing, standardise_memory
 from MDP_learning.single_agent.dynamics_learning import ModelLearner
+from MDP_learning.single_agent.dataset import TransitionDatasetWriter
+from MDP_learning.single_agent.missingness import MissingMask
 from fancyimpute import MICE
 
-for env_name in ['Swimmer-v1',
-                    #'BipedalWalker-v2',
-                    #'Hopper-v1',
-                 ]:
-    '''
-    Use the following to generate memories from scratch:
-    
-    env = gym.make(env_name)
-    print(env.observation_space)
-    canary = ModelLearner(env_name, env.observation_space, env.action_space, partial_obs_rate=0.0, sequence_length=0)
-    canary.refill_mem(env)
-    memory_arr = np.array(canary.memory)
-    print("Saving memory")
-    np.save('/home/aocc/code/DL/MDP_learning/save_memory/' + str(env_name) + 'FULL',
-            memory_arr)
-        
-    '''
-    # Load full memory to corrupt
-    memory_arr = np.load('/home/aocc/code/DL/MDP_learning/save_memory/' + str(env_name) + 'FULL.npy')
-    # partial observability rates
-    for rate in [0.25,0.50,0.75]:
-            for round in [0,1,2,3,4]:
-                print('Corrupting memory')
-                mem = memory_arr[round*1000000:round*1000000 + 1000000,...]
-                make_mem_partial_obs(mem,24,rate)
-                print("Saving corrupted memory")
-                np.save(
-                    '/home/aocc/code/DL/MDP_learning/save_memory/' + str(env_name) + 'CORRUPT' + str(rate), memory_arr)
-                print('Imputing missing values')
-                impute_missing(mem,24,MICE)
-                print("Saving imputed memory")
-                np.save(
-                    '/home/aocc/code/DL/MDP_learning/save_memory1/' + str(env_name) + 'IMPUTED' + str(rate) + 'round' + str(round), mem)
-                memory_arr = np.load('/home/aocc/code/DL/MDP_learning/save_memory/' + str(env_name) + 'FULL.npy')
+# collection below may spawn worker processes (n_workers), which re-import this module
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    # generate the FULL memories from scratch (seeded episodes, same data for any --n-workers) before corrupting
+    parser.add_argument('--collect', action='store_true')
+    parser.add_argument('--n-workers', type=int, default=1)
+    args = parser.parse_args()
+
+    for env_name in ['Swimmer-v1',
+                        #'BipedalWalker-v2',
+                        #'Hopper-v1',
+                     ]:
+        if args.collect:
+            env = gym.make(env_name)
+            print(env.observation_space)
+            canary = ModelLearner(env_name, env.observation_space, env.action_space, partial_obs_rate=0.0,
+                                  sequence_length=0, data_size=5000000, n_workers=args.n_workers, collect_seed=123)
+            canary.refill_mem(env)
+            print("Saving memory")
+            np.save('/home/aocc/code/DL/MDP_learning/save_memory/' + str(env_name) + 'FULL', np.array(canary.memory))
+
+        # Map full memory to corrupt, each round copies only its own slice into RAM
+        memory_arr = np.load('/home/aocc/code/DL/MDP_learning/save_memory/' + str(env_name) + 'FULL.npy', mmap_mode='r')
+        # dataset schema from the environment the memory was collected in
+        env = gym.make(env_name)
+        state_size = sum(env.observation_space.shape)
+        action_size = env.action_space.shape[0] if isinstance(env.action_space, gym.spaces.Box) else 1
+        if memory_arr.shape[1] != 2 * state_size + action_size + 2:
+            raise ValueError("{} rows are {} wide, expected (s, a, r, s', d) with state size {} and action size {}"
+                             .format(env_name, memory_arr.shape[1], state_size, action_size))
+        # clean and imputed rounds go into one dataset, tagged instead of encoded in file names
+        dataset = TransitionDatasetWriter('/home/aocc/code/DL/MDP_learning/save_memory1/' + str(env_name),
+                                          state_size, action_size, compression='zlib', env=env_name, source='FULL.npy')
+        # the clean rounds are stored once; corrupted versions are MissingMask(dones, state_size, rate, seed=round)
+        # over them, e.g. TransitionDataset(...).missing_mask(rate, seed=round, kind='FULL', round=round)
+        for round in [0,1,2,3,4]:
+            dataset.add_shard(memory_arr[round*1000000:round*1000000 + 1000000,...], kind='FULL', round=round)
+        # partial observability rates
+        for rate in [0.25,0.50,0.75]:
+                for round in [0,1,2,3,4]:
+                    print('Corrupting memory')
+                    mem = np.array(memory_arr[round*1000000:round*1000000 + 1000000,...])
+                    MissingMask(mem[:, -1], state_size, rate, seed=round).apply(mem)
+                    print('Imputing missing values')
+                    impute_missing(mem,state_size,MICE)
+                    print("Saving imputed memory")
+                    dataset.add_shard(mem, kind='IMPUTED', rate=rate, round=round, imputer='MICE', mask_seed=round)
 
 
 
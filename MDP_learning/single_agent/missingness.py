@@ -0,0 +1,61 @@
+import numpy as np
+
+# rows drawn per RandomState([seed, block]); fixed so that a mask only depends on (seed, rate)
+BLOCK_SIZE = 65536
+
+
+# Partial observability as a bit mask over a clean memory instead of a NaN-filled copy of it.
+# Each feature of a step's next state is missing with probability `rate`. Within an episode a
+# step's state is the previous step's next state and shares its mask; only the first step of an
+# episode draws its own state mask (as in preprocessing.make_mem_partial_obs).
+# The masks are drawn block by block from (seed, block), so one (seed, rate) always gives the
+# same corruption, and are kept packed at one bit per feature and step.
+class MissingMask(object):
+    def __init__(self, dones, state_size, rate, seed=0):
+        self.state_size = state_size
+        self.rate = rate
+        self.seed = seed
+        dones = np.asarray(dones, dtype=np.bool_)
+        n = len(dones)
+
+        # first step of each episode, these use their own state mask
+        self.first_bits = np.packbits(np.concatenate(([True], dones[:-1])))
+        self.state_bits = np.empty((n, (state_size + 7) // 8), dtype=np.uint8)
+        self.next_bits = np.empty((n, (state_size + 7) // 8), dtype=np.uint8)
+        for block, lo in enumerate(range(0, n, BLOCK_SIZE)):
+            hi = min(lo + BLOCK_SIZE, n)
+            rng = np.random.RandomState([seed, block])
+            self.state_bits[lo:hi] = np.packbits(rng.random_sample((hi - lo, state_size)) < rate, axis=1)
+            self.next_bits[lo:hi] = np.packbits(rng.random_sample((hi - lo, state_size)) < rate, axis=1)
+
+    def __len__(self):
+        return len(self.next_bits)
+
+    @property
+    def nbytes(self):
+        return self.first_bits.nbytes + self.state_bits.nbytes + self.next_bits.nbytes
+
+    def unpack(self, bits):
+        return np.unpackbits(bits, axis=-1)[..., :self.state_size].astype(np.bool_)
+
+    # boolean (len(idx), state_size) masks, True where the feature is missing
+    def next_state_mask(self, idx):
+        return self.unpack(self.next_bits[idx])
+
+    def state_mask(self, idx):
+        idx = np.asarray(idx)
+        first = (self.first_bits[idx >> 3] >> (7 - (idx & 7))) & 1
+        own = self.unpack(self.state_bits[idx])
+        inherited = self.unpack(self.next_bits[np.maximum(idx - 1, 0)])
+        return np.where(first[..., np.newaxis].astype(np.bool_), own, inherited)
+
+    # NaN the missing features of rows [start, start + len(memory)) of a legacy (s, a, r, s', d) block, in place
+    def apply(self, memory, start=0):
+        return self.apply_rows(memory, np.arange(start, start + len(memory)))
+
+    # same for a block holding the rows idx, in any order
+    def apply_rows(self, memory, idx):
+        s = self.state_size
+        memory[:, :s][self.state_mask(idx)] = np.nan
+        memory[:, -s - 1:-1][self.next_state_mask(idx)] = np.nan
+        return memory
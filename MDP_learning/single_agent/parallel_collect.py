@@ -0,0 +1,160 @@
+import multiprocessing
+from collections import deque
+
+import gym
+import numpy as np
+
+from MDP_learning.helpers.shared_replay import COLUMNS, SharedTransitionBuffer, SharedTransitionWriter
+from MDP_learning.single_agent.memory import TransitionMemory
+
+
+# One collector process: its own environment and seeded RNG, stepping a random policy
+# and writing every transition into its own segment of the shared buffer.
+def rollout_worker(spec, writer_id, env_name, n_steps, seed):
+    np.random.seed(seed)
+    env = gym.make(env_name)
+    env.seed(seed)
+    if hasattr(env.action_space, 'seed'):
+        env.action_space.seed(seed)
+    writer = SharedTransitionWriter(spec, writer_id)
+    state = env.reset()
+    for i in range(n_steps):
+        action = env.action_space.sample()
+        next_state, reward, done, info = env.step(action)
+        writer.append(state, action, reward, next_state, done)
+        if done:
+            state = env.reset()
+        else:
+            state = next_state
+    writer.close()
+
+
+# Collect n_steps transitions of a gym environment with n_workers processes writing to shared
+# memory, then merge the segments worker by worker into `memory` (a new TransitionMemory by default).
+# Each worker's steps stay contiguous and an episode boundary is put where two workers meet.
+# Workers are spawned rather than forked so they never inherit the parent's tensorflow state.
+def collect_parallel(env_name, n_steps, n_workers, state_size, action_size, seed=0, memory=None):
+    per_worker = [n_steps // n_workers + (ii < n_steps % n_workers) for ii in range(n_workers)]
+    buffer = SharedTransitionBuffer(n_workers, max(per_worker), state_size, action_size)
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        workers = [ctx.Process(target=rollout_worker, args=(buffer.spec, ii, env_name, per_worker[ii], seed + ii))
+                   for ii in range(n_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [ii for ii, worker in enumerate(workers) if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError("Rollout workers {} failed".format(failed))
+
+        if memory is None:
+            memory = TransitionMemory(n_steps, state_size, action_size)
+        memory.clear()
+        offset = 0
+        for ii in range(n_workers):
+            rows = np.arange(offset, offset + per_worker[ii])
+            memory.put(rows, *[buffer.segment(ii, name) for name in COLUMNS])
+            offset += per_worker[ii]
+        memory.commit(per_worker)
+    finally:
+        buffer.close()
+    return memory
+
+
+# Seeded collection that gives the same data for any number of workers: every episode gets its
+# own seed derived from (base_seed, episode index), which seeds the environment and the action RNG,
+# and episodes are merged in index order, so which worker ran an episode makes no difference.
+def episode_seed(base_seed, episode):
+    return int(np.random.RandomState([base_seed, episode]).randint(2 ** 31 - 1))
+
+
+_worker_env = None  # one environment per pool process, made by init_episode_worker
+
+
+def init_episode_worker(env_name):
+    global _worker_env
+    _worker_env = gym.make(env_name)
+
+
+# a uniformly random action of a Discrete or Box space drawn from rng, independent of how
+# the installed gym samples and seeds its spaces
+def random_action(space, rng):
+    if isinstance(space, gym.spaces.Discrete):
+        return rng.randint(space.n)
+    return rng.uniform(space.low, space.high)
+
+
+# run one episode of at most max_steps steps, returns its (s, a, r, s', d) columns;
+# the actions come from the episode's own RNG, the global np.random state is left alone
+def run_episode(args):
+    base_seed, episode, max_steps = args
+    seed = episode_seed(base_seed, episode)
+    env = _worker_env
+    rng = np.random.RandomState(seed)
+    env.seed(seed)
+    states, actions, rewards, next_states, dones = [], [], [], [], []
+    state = env.reset()
+    for i in range(max_steps):
+        action = random_action(env.action_space, rng)
+        next_state, reward, done, info = env.step(action)
+        states.append(state)
+        actions.append(action)
+        rewards.append(reward)
+        next_states.append(next_state)
+        dones.append(done)
+        if done:
+            break
+        state = next_state
+    return (np.array(states, dtype=np.float32), np.reshape(np.array(actions, dtype=np.float32), (len(dones), -1)),
+            np.array(rewards, dtype=np.float32), np.array(next_states, dtype=np.float32),
+            np.array(dones, dtype=np.bool_))
+
+
+# stands in for a pool's AsyncResult when the episodes run in this process
+class InProcessResult(object):
+    def __init__(self, result):
+        self.result = result
+
+    def get(self):
+        return self.result
+
+
+# Collect n_steps transitions as whole episodes first_episode, first_episode + 1, ... (the last one cut
+# at n_steps) with n_workers pool processes. Returns the memory and the number of episodes used, so the
+# next round can continue from first_episode + n_episodes.
+def collect_episodes(env_name, n_steps, n_workers, state_size, action_size, base_seed=0, first_episode=0,
+                     memory=None):
+    if memory is None:
+        memory = TransitionMemory(n_steps, state_size, action_size)
+    memory.clear()
+    if n_workers > 1:
+        pool = multiprocessing.get_context('spawn').Pool(n_workers, initializer=init_episode_worker,
+                                                          initargs=(env_name,))
+
+        def submit(job):
+            return pool.apply_async(run_episode, (job,))
+    else:
+        pool = None
+        init_episode_worker(env_name)
+
+        def submit(job):
+            return InProcessResult(run_episode(job))
+    try:
+        collected = 0
+        episode = first_episode
+        pending = deque()
+        while collected < n_steps:
+            # one episode in flight per worker, each capped at the steps still missing when it is handed out;
+            # an episode is a prefix of its uncapped self, so the cap never changes the merged data
+            while len(pending) < n_workers:
+                pending.append(submit((base_seed, episode + len(pending), n_steps - collected)))
+            states, actions, rewards, next_states, dones = pending.popleft().get()
+            n = min(len(dones), n_steps - collected)
+            memory.extend(states[:n], actions[:n], rewards[:n], next_states[:n], dones[:n])
+            collected += n
+            episode += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return memory, episode - first_episode
@@ -0,0 +1,72 @@
+import threading
+from queue import Queue, Empty, Full
+
+from MDP_learning.single_agent.memory import TransitionMemory
+
+
+# Collects transitions in a background thread while the model trains.
+# Steps are handed over in blocks of block_size through a queue of at most max_staleness blocks:
+# once the trainer falls that far behind, the producer waits, so the data being trained on is
+# never more than max_staleness (+ the block in progress) blocks behind the environment.
+# Only the training side, in drain(), writes to the replay memory, so the memory needs no lock.
+class BackgroundCollector(object):
+    def __init__(self, environment, get_action, state_size, action_size, block_size=1000, max_staleness=4):
+        self.environment = environment
+        self.get_action = get_action
+        self.state_size = state_size
+        self.action_size = action_size
+        self.block_size = block_size
+        self.queue = Queue(maxsize=max_staleness)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.error = None
+        self.steps = 0  # steps handed over to the memory so far
+
+    def start(self):
+        self.thread.start()
+
+    def produce(self):
+        try:
+            state = self.environment.reset()
+            while not self.stopping.is_set():
+                block = TransitionMemory(self.block_size, self.state_size, self.action_size)
+                for i in range(self.block_size):
+                    action = self.get_action(state, self.environment)
+                    next_state, reward, done, info = self.environment.step(action)
+                    block.append(state, action, reward, next_state, done)
+                    if done:
+                        state = self.environment.reset()
+                    else:
+                        state = next_state
+                while not self.stopping.is_set():
+                    try:
+                        self.queue.put(block, timeout=0.1)
+                        break
+                    except Full:
+                        continue
+        except Exception as e:
+            self.error = e
+
+    # append all finished blocks to the memory; with wait, block until there is at least one,
+    # which raises if the producer has stopped and none is left
+    def drain(self, memory, wait=False):
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                block = self.queue.get(timeout=0.1) if wait else self.queue.get_nowait()
+            except Empty:
+                if wait and self.thread.is_alive():
+                    continue
+                if wait:
+                    if self.error is not None:
+                        raise self.error
+                    raise RuntimeError("The background collector stopped without handing over a block")
+                return
+            memory.extend(block.states, block.actions, block.rewards, block.next_states, block.dones)
+            self.steps += len(block)
+            wait = False
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
@@ -2,6 +2,7 @@ import numpy as np
 from sklearn.preprocessing import scale, MinMaxScaler
 from fancyimpute import MICE, KNN
 from copy import deepcopy
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 def standardise_memory(memory, state_size, action_size):
@@ -15,18 +16,19 @@ def standardise_memory(memory, state_size, action_size):
     memory[:, state_size: state_size + action_size] = actions_scaled
 
 
+# A step's state is the previous step's (corrupted) next state, except at the first step of an
+# episode, which gets its own mask; the masks are drawn as before, so a seed gives the same corruption
 def make_mem_partial_obs(memory, state_size, partial_obs_rate):
     masks_states = np.random.choice([np.nan, 1.0], size=(len(memory), state_size),
                                     p=[partial_obs_rate, 1 - partial_obs_rate])
     masks_next_states = np.random.choice([np.nan, 1.0], size=(len(memory), state_size),
                                          p=[partial_obs_rate, 1 - partial_obs_rate])
-    for i in range(len(memory)):
-        if i == 0 or memory[i - 1, -1]:
-            memory[i, :state_size] = masks_states[i] * memory[i, :state_size]
-            memory[i, - state_size - 1:-1] = masks_next_states[i] * memory[i, - state_size - 1:-1]
-        else:
-            memory[i, :state_size] = memory[i - 1, -state_size - 1:-1]
-            memory[i, - state_size - 1:-1] = masks_next_states[i] * memory[i, - state_size - 1:-1]
+    first = np.ones(len(memory), dtype=np.bool_)
+    first[1:] = memory[:-1, -1] != 0
+    memory[:, - state_size - 1:-1] = masks_next_states * memory[:, - state_size - 1:-1]
+    memory[first, :state_size] = masks_states[first] * memory[first, :state_size]
+    memory[~first, :state_size] = memory[np.flatnonzero(~first) - 1, - state_size - 1:-1]
+
 
 def impute_missing(memory, state_size, imputer):
     states = np.vstack((memory[:, :state_size], memory[:, - state_size - 1:-1]))
@@ -34,22 +36,31 @@ def impute_missing(memory, state_size, imputer):
     memory[:, :state_size] = states_imputed[:len(memory), :state_size]
     memory[:, - state_size - 1:-1] = states_imputed[len(memory):, :state_size]
 
-def setup_batch_for_RNN(batch, sequence_length, state_size, action_size):
-    batch_size = batch.shape[0]
-    array_size = batch_size - sequence_length + 1
-    x_seq = np.empty((array_size, sequence_length, state_size + action_size))
-    y_seq = np.empty((array_size, state_size))
-    actual_size = 0
-    for jj in range(array_size):
-        if not batch[jj:jj + sequence_length - 1, -1].any():
-            x_seq[actual_size, ...] = batch[np.newaxis,
-                                      jj:jj + sequence_length,
-                                      :state_size + action_size]
-            y_seq[actual_size, ...] = batch[np.newaxis,
-                                      jj + sequence_length - 1,
-                                      -state_size - 1:-1]
-            actual_size += 1
-    x_seq = np.resize(x_seq, (actual_size, sequence_length, state_size + action_size))
-    y_seq = np.resize(y_seq, (actual_size, state_size))
-    return x_seq, y_seq
+# first rows of the windows of sequence_length steps without a terminal among their first
+# sequence_length - 1 rows, from a prefix sum of the done column
+def rnn_valid_starts(dones, sequence_length):
+    terminals = np.concatenate(([0], np.cumsum(dones != 0)))
+    n_windows = len(dones) - sequence_length + 1
+    return np.flatnonzero(terminals[sequence_length - 1:sequence_length - 1 + n_windows] == terminals[:n_windows])
+
+
+# strided views of all overlapping windows of a legacy (s, a, r, s', d) batch, no copies:
+# [N - L + 1, L, s + a] inputs and [N - L + 1, s'] targets (the s' of each window's last row)
+def rnn_windows(batch, sequence_length, state_size, action_size):
+    x_windows = sliding_window_view(batch[:, :state_size + action_size], sequence_length, axis=0)
+    return x_windows.transpose(0, 2, 1), batch[sequence_length - 1:, -state_size - 1:-1]
+
 
+# valid_starts, e.g. from an EpisodeIndex, skips scanning the done column for terminals;
+# with views the windows are not gathered, (x windows, y windows, valid starts) are returned instead
+def setup_batch_for_RNN(batch, sequence_length, state_size, action_size, valid_starts=None, views=False):
+    x_windows, y_windows = rnn_windows(batch, sequence_length, state_size, action_size)
+    if views:
+        if valid_starts is None:
+            valid_starts = rnn_valid_starts(batch[:, -1], sequence_length)
+        return x_windows, y_windows, valid_starts
+    if valid_starts is None:
+        valid_starts = rnn_valid_starts(batch[:, -1], sequence_length)
+    # float64 like the windows always were when the done column was scanned, whoever found the starts
+    return x_windows[valid_starts].astype(np.float64, copy=False), \
+        y_windows[valid_starts].astype(np.float64, copy=False)
@@ -0,0 +1,154 @@
+import numpy as np
+
+from MDP_learning.helpers.episode_index import EpisodeIndex
+
+
+# Read-only view over several saved (s, a, r, s', d) memories (.npy shards).
+# The shards are memory-mapped and concatenated virtually, so a 5M row dataset
+# never has to be loaded or vstacked in RAM; only the rows asked for are read.
+# Shards are .npy paths or already opened row-sliceable arrays (see dataset.ChunkRows).
+class MmapTransitionStore(object):
+    def __init__(self, shards, state_size, action_size):
+        self.state_size = state_size
+        self.action_size = action_size
+        self.shards = [np.load(shard, mmap_mode='r') if isinstance(shard, str) else shard for shard in shards]
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+        # per column min/max scaling, see set_minmax_scaling
+        self.scale_min = None
+        self.scale_range = None
+        # missingness.MissingMask applied to the rows read, see set_missing_mask
+        self.missing = None
+        # episode boundaries, read from the done column on the first window request
+        self.episodes = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.rows(0, len(self))
+        return arr if dtype is None else arr.astype(dtype)
+
+    # rows [start, stop) of the concatenated shards as one float32 array
+    def rows(self, start, stop):
+        stop = min(stop, len(self))
+        out = np.empty((max(stop - start, 0), self.shards[0].shape[1]), dtype=np.float32)
+        first = np.searchsorted(self.offsets, start, side='right') - 1
+        for ii in range(first, len(self.shards)):
+            if self.offsets[ii] >= stop:
+                break
+            lo = max(start, self.offsets[ii])
+            hi = min(stop, self.offsets[ii + 1])
+            out[lo - start:hi - start] = self.shards[ii][lo - self.offsets[ii]:hi - self.offsets[ii]]
+        return self.prepare(out, np.arange(start, stop))
+
+    # rows idx (any order) of the concatenated shards as one float32 array, read shard by shard
+    def take(self, idx):
+        idx = np.asarray(idx)
+        out = np.empty((len(idx), self.shards[0].shape[1]), dtype=np.float32)
+        shard_of = np.searchsorted(self.offsets, idx, side='right') - 1
+        for ii in np.unique(shard_of):
+            sel = shard_of == ii
+            out[sel] = self.shards[ii][idx[sel] - self.offsets[ii]]
+        return self.prepare(out, idx)
+
+    # missing features and scaling of the rows idx just read into out, in place
+    def prepare(self, out, idx):
+        if self.missing is not None:
+            self.missing.apply_rows(out, idx)
+        if self.scale_min is not None:
+            out -= self.scale_min
+            out /= self.scale_range
+        return out
+
+    # read the clean rows as partially observed, with the NaNs of a MissingMask over all rows
+    def set_missing_mask(self, mask):
+        assert mask is None or len(mask) == len(self)
+        self.missing = mask
+
+    def iter_chunks(self, chunk_size, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        for lo in range(start, stop, chunk_size):
+            yield self.rows(lo, min(lo + chunk_size, stop))
+
+    # streaming equivalent of preprocessing.standardise_memory:
+    # states and next states share one scaler, actions get their own
+    def set_minmax_scaling(self, chunk_size=100000):
+        s, a = self.state_size, self.action_size
+        self.scale_min = None
+        col_min = np.full(self.shards[0].shape[1], np.inf, dtype=np.float32)
+        col_max = np.full(self.shards[0].shape[1], -np.inf, dtype=np.float32)
+        for chunk in self.iter_chunks(chunk_size):
+            col_min = np.fmin(col_min, np.nanmin(chunk, axis=0))
+            col_max = np.fmax(col_max, np.nanmax(chunk, axis=0))
+        state_min = np.minimum(col_min[:s], col_min[-s - 1:-1])
+        state_max = np.maximum(col_max[:s], col_max[-s - 1:-1])
+
+        scale_min = np.zeros_like(col_min)
+        scale_max = np.ones_like(col_max)
+        scale_min[:s], scale_max[:s] = state_min, state_max
+        scale_min[-s - 1:-1], scale_max[-s - 1:-1] = state_min, state_max
+        scale_min[s:s + a], scale_max[s:s + a] = col_min[s:s + a], col_max[s:s + a]
+        scale_range = scale_max - scale_min
+        scale_range[scale_range == 0] = 1.  # same as MinMaxScaler for constant features
+        self.scale_min, self.scale_range = scale_min, scale_range
+
+    # network input (s, a) and target s' - s for rows [start, stop)
+    def transition_batch(self, start=0, stop=None):
+        arr = self.rows(start, len(self) if stop is None else stop)
+        s = self.state_size
+        return arr[:, :s + self.action_size], arr[:, -s - 1:-1] - arr[:, :s]
+
+    # first rows of the windows of sequence_length steps that stay inside one episode
+    def valid_starts(self, sequence_length, chunk_size=100000):
+        if self.episodes is None:
+            self.episodes = EpisodeIndex()
+            for chunk in self.iter_chunks(chunk_size):
+                self.episodes.extend(chunk[:, -1] != 0)
+        return self.episodes.valid_starts(sequence_length)
+
+    # RNN input windows (len(starts), sequence_length, s + a) and the next state after each window,
+    # as preprocessing.setup_batch_for_RNN; only the rows of the windows are read
+    def window_batch(self, starts, sequence_length):
+        starts = np.asarray(starts)
+        windows = starts[:, np.newaxis] + np.arange(sequence_length)
+        flat, inverse = np.unique(windows, return_inverse=True)
+        rows = self.take(flat)[inverse.reshape(windows.shape)]
+        s = self.state_size
+        return rows[..., :s + self.action_size], rows[:, -1, -s - 1:-1]
+
+    # all valid windows at once
+    def sequence_batch(self, sequence_length):
+        return self.window_batch(self.valid_starts(sequence_length), sequence_length)
+
+    # [lo, hi) read blocks of at most chunk_size rows covering [start, stop), one list per shard.
+    # Blocks never cross a shard, and a dataset store has one shard per (compressed) chunk, so a
+    # shard's blocks read one after the other decode its chunk only once
+    def blocks(self, start, stop, chunk_size):
+        groups = []
+        for ii in range(len(self.shards)):
+            lo, hi = max(start, self.offsets[ii]), min(stop, self.offsets[ii + 1])
+            if lo < hi:
+                groups.append([(b, min(b + chunk_size, hi)) for b in range(lo, hi, chunk_size)])
+        return groups
+
+    # endless keras generator of (x, y) minibatches over rows [start, stop)
+    # visits the shards in random order and shuffles the rows within each block read
+    def generator(self, minibatch_size, start=0, stop=None, chunk_size=100000, shuffle=True):
+        stop = len(self) if stop is None else stop
+        groups = self.blocks(start, stop, chunk_size)
+        while True:
+            if shuffle:
+                np.random.shuffle(groups)
+            for group in groups:
+                for kk in (np.random.permutation(len(group)) if shuffle else range(len(group))):
+                    x, y = self.transition_batch(*group[kk])
+                    order = np.random.permutation(len(x)) if shuffle else np.arange(len(x))
+                    for jj in range(0, len(x), minibatch_size):
+                        idx = order[jj:jj + minibatch_size]
+                        yield x[idx], y[idx]
+
+    def steps_per_epoch(self, minibatch_size, start=0, stop=None, chunk_size=100000):
+        stop = len(self) if stop is None else stop
+        return sum(-(-(hi - lo) // minibatch_size)
+                   for group in self.blocks(start, stop, chunk_size) for lo, hi in group)
@@ -14,6 +14,7 @@ import matplotlib
 from collections import namedtuple
 import matplotlib.pyplot as plt
 from sklearn.preprocessing import Imputer
+from MDP_learning.single_agent.preprocessing import make_mem_partial_obs
 
 '''
 GRID SEARCH RESULT
@@ -214,19 +215,7 @@ class ModelLearner:
 
 
     def corrupt_mem(self, memory):
-        masks_states = np.random.choice([np.nan, 1.0], size=(len(memory), self.state_size),
-                                        p=[self.mcar_rate, 1 - self.mcar_rate])
-        masks_next_states = np.random.choice([np.nan, 1.0], size=(len(memory), self.state_size),
-                                             p=[self.mcar_rate, 1 - self.mcar_rate])
-        memory[:, self.state_size:self.state_size+1] = memory[:, self.state_size:self.state_size+1]
-        for i in range(len(memory)):
-            if i == 0 or memory[i - 1, -1]:
-                memory[i, :self.state_size] = masks_states[i] * memory[i, :self.state_size]
-                memory[i, self.state_size + self.action_size + 1:-1] = masks_next_states[i] * memory[i, self.state_size + self.action_size + 1:-1]
-            else:
-                memory[i, :self.state_size] = memory[i - 1, self.state_size + self.action_size + 1:-1]
-                memory[i, self.state_size + self.action_size + 1:-1] = masks_next_states[i] * memory[i, self.state_size + self.action_size + 1:-1]
-
+        make_mem_partial_obs(memory, self.state_size, self.mcar_rate)
 
     def impute_mem(self, memory):
         imputer = Imputer()
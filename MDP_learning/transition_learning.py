@@ -12,6 +12,10 @@ import matplotlib
 # matplotlib.use('GTK3Cairo', warn=False, force=True)
 import matplotlib.pyplot as plt
 
+from MDP_learning.helpers.prioritized_replay import fit_prioritized
+from MDP_learning.single_agent.memory import ReservoirTransitionMemory
+from MDP_learning.helpers.vec_env import VecEnv
+
 '''
 GRID SEARCH RESULT
 Best parameter set was 
@@ -21,7 +25,8 @@ Best parameter set was
 
 class ModelLearner:
     def __init__(self, observation_space, action_space, data_size=10000, epochs=4, learning_rate=.001,
-                 tmodel_dim_multipliers=(6, 6), tmodel_activations=('relu', 'sigmoid'), recurrent=False):
+                 tmodel_dim_multipliers=(6, 6), tmodel_activations=('relu', 'sigmoid'), recurrent=False,
+                 prioritized=False, continual=None, round_size=None, n_envs=1):
 
         # get size of state and action from environment
         self.state_size = sum(observation_space.shape)
@@ -37,8 +42,16 @@ class ModelLearner:
         self.learning_rate = learning_rate
         self.net_train_epochs = epochs
         self.data_size = data_size
-        self.memory = deque(maxlen=self.data_size)
+        # with continual='reservoir'/'recency' the memory is kept across rounds as a bounded sample of all steps
+        self.continual = continual
+        self.round_size = data_size if round_size is None else round_size  # new steps collected per round
+        if continual:
+            self.memory = ReservoirTransitionMemory(self.data_size, self.state_size, self.action_size, mode=continual)
+        else:
+            self.memory = deque(maxlen=self.data_size)
+        self.n_envs = n_envs  # environment copies stepped in lockstep by refill_mem
         self.recurrent = recurrent
+        self.prioritized = prioritized  # tmodel minibatches sampled by prediction error
 
         self.tmodel = self.build_regression_model(self.state_size + self.action_size, self.state_size, lr=learning_rate,
                                                   dim_multipliers=tmodel_dim_multipliers,
@@ -103,12 +116,21 @@ class ModelLearner:
         batch = np.array(self.memory)
 
         # and do the model fit
-        self.tmodel.fit(batch[:, :self.state_size + self.action_size],
-                        batch[:, -self.state_size - 1:-1],
-                        batch_size=minibatch_size,
-                        epochs=self.net_train_epochs,
-                        validation_split=0.1,
-                        callbacks=self.Ttensorboard, verbose=1)
+        if self.prioritized:
+            fit_prioritized(self.tmodel,
+                            batch[:, :self.state_size + self.action_size],
+                            batch[:, -self.state_size - 1:-1],
+                            minibatch_size=minibatch_size,
+                            epochs=self.net_train_epochs,
+                            validation_split=0.1,
+                            callbacks=self.Ttensorboard)
+        else:
+            self.tmodel.fit(batch[:, :self.state_size + self.action_size],
+                            batch[:, -self.state_size - 1:-1],
+                            batch_size=minibatch_size,
+                            epochs=self.net_train_epochs,
+                            validation_split=0.1,
+                            callbacks=self.Ttensorboard, verbose=1)
 
         # TODO Currently predicts reward based on state input data.
         #  Should we consider making reward predictions action-dependent too?
@@ -139,22 +161,55 @@ class ModelLearner:
         # TODO how sure do we want to be about being done? 80%? 90?
         # TODO yah to force the type to be the same as in gym environment (flatten?)
 
+    def get_actions(self, states, environments):
+        return np.array([self.get_action(state, env) for state, env in zip(states, environments.envs)])
+
     def refill_mem(self, environment):
+        if self.n_envs > 1:
+            self.refill_mem_vectorized(environment)
+            return
         state = environment.reset()
-        self.memory.clear()
-        for i in range(self.data_size):
+        if self.continual:
+            self.memory.break_sequence()
+        else:
+            self.memory.clear()
+        for i in range(self.round_size):
             # get action for the current state and go one step in environment
             action = self.get_action(state, environment)
             next_state, reward, done, info = environment.step(action)
 
             # save the sample <s, a, r, s'> to the replay memory
-            self.memory.append(np.hstack((state, action, reward, next_state, done * 1)))
+            if self.continual:
+                self.memory.append(state, action, reward, next_state, done)
+            else:
+                self.memory.append(np.hstack((state, action, reward, next_state, done * 1)))
 
             if done:  # and np.random.rand() <= .5:  # TODO super hacky way to get 0 rewards in cartpole
                 state = environment.reset()
             else:
                 state = next_state
 
+    # n_envs copies of the environment stepped in lockstep, each tick adds one [n_envs, ...] slab
+    def refill_mem_vectorized(self, environment):
+        envs = environment if isinstance(environment, VecEnv) else VecEnv.copies(environment, self.n_envs)
+        if self.continual:
+            self.memory.break_sequence()
+        else:
+            self.memory.clear()
+        states = envs.reset()
+        for i in range(-(-self.round_size // envs.n_envs)):
+            actions = self.get_actions(states, envs)
+            next_states, rewards, dones = envs.step(actions)
+            # the last tick only keeps the steps still missing from round_size
+            n = min(envs.n_envs, self.round_size - i * envs.n_envs)
+            if self.continual:
+                for row in list(zip(states, actions, rewards, next_states, dones))[:n]:
+                    self.memory.append(*row)
+            else:
+                self.memory.extend(np.hstack((states, np.reshape(actions, (envs.n_envs, -1)), rewards[:, np.newaxis],
+                                              next_states, dones[:, np.newaxis]))[:n])
+            states = envs.states
+
     def run(self, environment, rounds=1):
         for e in range(rounds):
             self.refill_mem(environment)